@@ -0,0 +1,84 @@
+from __future__ import unicode_literals, print_function
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+from qordoba.commands.utils import mkdirs
+from qordoba.state import replace_file
+
+log = logging.getLogger('qordoba')
+
+DEFAULT_CACHE_DIR = os.environ.get('QORDOBA_CACHE_DIR') or \
+    os.path.join(os.path.expanduser('~'), '.qordoba', 'cache')
+
+
+def make_key(*parts):
+    return hashlib.sha1('\n'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+
+class ResponseCache(object):
+    """
+    API responses stored on disk, one JSON file per key.
+
+    Entries older than `ttl` seconds are not fresh anymore, but are kept
+    with their validators, so they can be revalidated.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_DIR, ttl=3600, enabled=True):
+        self.path = path
+        self.ttl = ttl
+        self.enabled = enabled
+
+    def _file(self, key):
+        return os.path.join(self.path, '{}.json'.format(key))
+
+    def load(self, key):
+        """
+        :return: dict with `created`, `body` and `validators` keys or None
+        """
+        if not self.enabled:
+            return None
+
+        try:
+            with open(self._file(key), 'r') as f:
+                return json.load(f)
+        except IOError:
+            return None
+        except ValueError:
+            log.debug('Broken cache entry `{}` ignored'.format(self._file(key)))
+            return None
+
+    def is_fresh(self, entry):
+        return entry is not None and time.time() - entry['created'] < self.ttl
+
+    def store(self, key, body, validators=None, size=None):
+        """
+        :param dict validators: `etag` and `last_modified` of the response
+        :param int size: Response content length
+        """
+        if not self.enabled:
+            return
+
+        entry = {
+            'created': time.time(),
+            'body': body,
+            'validators': validators or {},
+            'size': size,
+        }
+
+        try:
+            mkdirs(self.path)
+            fd, tmp_path = tempfile.mkstemp(dir=self.path, prefix='.{}.'.format(key))
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(entry, f)
+                replace_file(tmp_path, self._file(key))
+            except Exception:
+                os.remove(tmp_path)
+                raise
+        except (IOError, OSError) as e:
+            log.debug('Could not write cache entry `{}`: {}'.format(self._file(key), e))
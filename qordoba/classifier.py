@@ -1,4 +1,5 @@
 import os
+import threading
 from binaryornot.check import is_binary
 import logging
 log = logging.getLogger('qordoba')
@@ -6,10 +7,32 @@ log = logging.getLogger('qordoba')
 from sklearn.pipeline import Pipeline
 from sklearn import naive_bayes as nb
 from sklearn.feature_extraction.text import CountVectorizer
-from sklearn.externals import joblib
+try:
+    import joblib
+except ImportError:
+    # scikit-learn < 0.21 vendors joblib
+    from sklearn.externals import joblib
 import datetime
 
+MODEL_PATH = '../resources/finalized_model.joblib.pkl'
+
+# files vectorized at once. Bounds the memory of the sparse matrix
+PREDICT_BATCH_SIZE = 1000
+
 classifier_model = None
+_model_lock = threading.Lock()
+
+
+def get_model():
+    """
+    Model loaded once and kept for the process lifetime.
+    """
+    global classifier_model
+    with _model_lock:
+        if classifier_model is None:
+            classifier_model = joblib.load(MODEL_PATH)
+            log.info('Model loaded')
+        return classifier_model
 
 # class Strategy():
 #     strategy_name = ''
@@ -57,47 +80,68 @@ class Classifier():
         log.info("-- Done training. Training time:{}".format(datetime.datetime.now() - time))
         timenew = datetime.datetime.now()
 
-        filename = '../resources/finalized_model.joblib.pkl'
-        _ = joblib.dump(pipeline, filename, compress=9)
+        _ = joblib.dump(pipeline, MODEL_PATH, compress=9)
 
         log.info("-- Saved trained model to finalized_model (time:{})".format(datetime.datetime.now() - timenew))
-        return pipeline
 
-    def predict(self, blob):
         global classifier_model
-        if not classifier_model:
-            filename = '../resources/finalized_model.joblib.pkl'
-            classifier_model = joblib.load(filename)
-            log.info('Model loaded')
+        with _model_lock:
+            classifier_model = pipeline
+        return pipeline
+
+    def predict_many(self, blobs, batch_size=PREDICT_BATCH_SIZE):
+        """
+        Predict the type of many files. Every batch is vectorized into one sparse matrix
+        and predicted at once.
+        :param blobs: iterable of file paths
+        :return: list of predictions in the order of `blobs`. None for binary files
+        """
+        model = get_model()
 
         time = datetime.datetime.now()
         log.info("Starting prediction")
 
-        Examples = []
-        Files = [blob, '../resources/finalized_model.joblib.pkl']
+        predictions = []
+        batch = []
+        for blob in blobs:
+            if is_binary(blob):
+                predictions.append(None)
+                continue
 
-        for file_ in Files:
-            if is_binary(file_):
-                pass
-            else:
-                with open(file_, "r") as src_file_:
-                    Examples.append(src_file_.read())
+            with open(blob, "r") as src_file_:
+                batch.append((len(predictions), src_file_.read()))
+            predictions.append(None)
+            if len(batch) >= batch_size:
+                self._predict_batch(model, batch, predictions)
+                batch = []
 
-        predict_examples = classifier_model.predict(Examples)
+        if batch:
+            self._predict_batch(model, batch, predictions)
 
-        log.info("Finished with prediction within {} ".format(datetime.datetime.now() - time))
-        log.info("predict_examples {} ".format(predict_examples))
+        log.info("Finished with prediction of {} files within {} ".format(len(predictions),
+                                                                         datetime.datetime.now() - time))
+        return predictions
 
+    @staticmethod
+    def _predict_batch(model, batch, predictions):
+        indexes, examples = zip(*batch)
+        for index, prediction in zip(indexes, model.predict(list(examples))):
+            predictions[index] = prediction
+
+    def predict(self, blob):
+        predict_examples = self.predict_many([blob])
+        log.info("predict_examples {} ".format(predict_examples))
         return predict_examples
 
-    def find_type(self, blob):
-        if os.path.exists('../resources/finalized_model.joblib.pkl'):
-            log.info("finalized model exists. \n Starting prediction")
-            predictions = self.predict(blob)
-            return str(predictions[0])
-        else:
-            open("../resources/finalized_model.joblib.pkl", 'w')
+    def find_types(self, blobs):
+        """
+        :param blobs: iterable of file paths
+        :return: list of types in the order of `blobs`. None for binary files
+        """
+        if not os.path.exists(MODEL_PATH):
             self.train()
             log.info("Training done. Starting prediction")
-            predictions = self.predict(blob)
-            return str(predictions[0])
\ No newline at end of file
+        return [None if prediction is None else str(prediction) for prediction in self.predict_many(blobs)]
+
+    def find_type(self, blob):
+        return self.find_types([blob])[0]
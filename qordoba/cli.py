@@ -16,6 +16,7 @@ from qordoba.commands.ls import ls_command
 from qordoba.commands.pull import pull_command
 from qordoba.commands.push import push_command
 from qordoba.commands.status import status_command, status_command_json
+from qordoba.project import session_stats, conditional_stats
 from qordoba.settings import load_settings, SettingsError
 from qordoba.utils import with_metaclass, FilePathType, CommaSeparatedSet
 from qordoba.log import init
@@ -67,7 +68,8 @@ class BaseHandler(with_metaclass(ABCMeta)):
     def load_settings(self):
         config, loaded = load_settings(access_token=self.access_token,
                                        project_id=self.project_id,
-                                       organization_id=self.organization_id)
+                                       organization_id=self.organization_id,
+                                       refresh_cache=self.refresh or None)
         config.validate()
         if not loaded:
             log.info('Config not found...')
@@ -93,6 +95,8 @@ class BaseHandler(with_metaclass(ABCMeta)):
                             default=None)
         parser.add_argument('--traceback', dest='traceback', action='store_true')
         parser.add_argument('--debug', dest='debug', default=False, action='store_true')
+        parser.add_argument('--refresh', dest='refresh', default=False, action='store_true',
+                            help='Ignore cached languages and project details.')
         parser.add_argument('-h', '--help', action='help', default=argparse.SUPPRESS,
                             help='Show this help message and exit.')
 
@@ -205,6 +209,10 @@ class PullHandler(BaseHandler):
         parser.add_argument('-d', '--distinct', dest='distinct', action='store_true',
                             help="Allows you to pull distinct filenames.")
         parser.add_argument('--version', dest='version', default=None, type=str, help="Set version tag.")
+        parser.add_argument('-j', '--jobs', dest='jobs', default=1, type=int,
+                            help="Number of files to download in parallel.")
+        parser.add_argument('-i', '--incremental', dest='incremental', action='store_true',
+                            help="Download only translations updated since the last pull.")
         group = parser.add_mutually_exclusive_group()
         group.add_argument('--skip', dest='skip', action='store_true', help='Skip downloading if file exists.')
         group.add_argument('--replace', dest='replace', action='store_true', help='Replace existing file.')
@@ -231,7 +239,8 @@ class PullHandler(BaseHandler):
             languages.extend(self.languages)
 
         pull_command(self._curdir, config, files=self.files, languages=set(itertools.chain(*languages)),
-                     in_progress=self.in_progress, update_action=self.get_update_action(), force=self.force, custom=self.custom, bulk=self.bulk, version=self.version, workflow=self.workflow, workflow_all=self.workflow_all, distinct=self.distinct)
+                     in_progress=self.in_progress, update_action=self.get_update_action(), force=self.force, custom=self.custom, bulk=self.bulk, version=self.version, workflow=self.workflow, workflow_all=self.workflow_all, distinct=self.distinct,
+                     jobs=self.jobs, incremental=self.incremental)
 
 
 class PushHandler(BaseHandler):
@@ -251,12 +260,17 @@ class PushHandler(BaseHandler):
         parser.add_argument('files', nargs='*', metavar='PATH', default=None, type=FilePathType(), help="")
         parser.add_argument('--update', dest='update', default=False, action='store_true', help="Force to update file.")
         parser.add_argument('--version', dest='version', default=None, type=str, help="Set version tag.")
+        parser.add_argument('-j', '--jobs', dest='jobs', default=1, type=int,
+                            help="Number of files to upload in parallel.")
+        parser.add_argument('-f', '--force', dest='force', action='store_true',
+                            help="Push all files, even if they didn't change since the last push.")
         return parser
 
     def main(self):
         log.info('Loading Qordoba config...')
         config = self.load_settings()
-        push_command(self._curdir, config, update=self.update, version=self.version, files=self.files)
+        push_command(self._curdir, config, update=self.update, version=self.version, files=self.files,
+                     jobs=self.jobs, force=self.force)
 
 class ListHandler(BaseHandler):
     name = 'ls'
@@ -340,6 +354,14 @@ def main():
 
     try:
         cli_handler()
+        stats = session_stats()
+        if stats:
+            log.debug('HTTP connection pool: {requests} requests, {hits} reused, {misses} new connections'
+                      .format(**stats))
+        stats = conditional_stats()
+        if stats['requests']:
+            log.debug('Conditional requests: {requests} sent, {not_modified} not modified, {bytes_saved} bytes saved'
+                      .format(**stats))
     except Exception as e:
         log.critical(e)
         if args.traceback:
@@ -1,16 +1,23 @@
 from __future__ import unicode_literals, print_function
 
 import logging
+from qordoba.exclusions import get_exclusion_matcher
 from qordoba.languages import get_source_language, init_language_storage
 from qordoba.project import ProjectAPI
 from qordoba.settings import get_push_pattern
-from qordoba.sources import find_files_by_pattern
-from qordoba.strategies import Extension, Shebang
+from qordoba.sources import find_files_by_patterns, validate_path, to_posix
+from qordoba.state import FindNewState
+from qordoba.strategies import Extension, Filename, init_language_index
 
 
-import yaml
-import re
+import io
+import json
+import multiprocessing
+import os
 import sys
+import threading
+from collections import namedtuple
+
 import magic
 
 log = logging.getLogger('qordoba')
@@ -18,10 +25,15 @@ log = logging.getLogger('qordoba')
 
 STRATEGIES = [
                 Extension(),
-                Shebang(),
+                Filename(),
+                # Shebang doesn't return a result yet
             ]
 
-RESULTS = list()
+# files sent to a worker process at once
+CLASSIFY_CHUNK_SIZE = 16
+
+# up to this number of changed files are classified without worker processes
+INLINE_CLASSIFY_LIMIT = 32
 
 class FilesNotFound(Exception):
     """
@@ -35,84 +47,235 @@ def _text_characters():
     return txt
 
 
-def likely_binary(fileobj, blocksize=512):
-    x_file = open(fileobj, 'r')
-    block = x_file.read(blocksize)
+TEXT_CHARACTERS = _text_characters()
+
+# encoding and binary content are detected from this many first bytes
+INSPECT_BLOCK_SIZE = 16 * 1024
+
+FileInfo = namedtuple('FileInfo', ('binary', 'empty', 'encoding'))
+
+
+def likely_binary(block):
+    """
+    :param bytes block: Beginning of the file
+    """
     if b'\x00' in block:
         # Files with null bytes are binary
         return True
     elif not block:
         # An empty file is considered a valid text file
         return False
-    txt_characters = _text_characters()
-    nontext = block.translate(None, txt_characters)
+    nontext = block.translate(None, TEXT_CHARACTERS)
     # if nontext is more than 30%, than file considered binary
     return float(len(nontext)) / len(block) >= 0.30
 
-def encoding_binary(fileobj):
-    blob = open(fileobj).read()
-    m = magic.Magic(mime_encoding=True)
-    encoding = m.from_buffer(blob)
-    return encoding == 'binary'
 
+_MAGIC = None
+_MAGIC_LOCK = threading.Lock()
+
+
+def detect_encoding(block):
+    """
+    Detect encoding with one libmagic handle per process. The handle isn't thread safe.
+    """
+    global _MAGIC
+    with _MAGIC_LOCK:
+        if _MAGIC is None:
+            _MAGIC = magic.Magic(mime_encoding=True)
+        return _MAGIC.from_buffer(block)
 
-def empty(fileobj, blocksize=512):
-    y_file = open(fileobj).read(blocksize)
-    if not y_file:
-        return True
-    return False
 
+def inspect_file(path, blocksize=INSPECT_BLOCK_SIZE):
+    """
+    Read the beginning of the file once and tell if it is binary, empty and its encoding.
+    :rtype: FileInfo
+    """
+    with open(path, 'rb') as f:
+        block = f.read(blocksize)
 
-def regex_file_match(regexFile, string):
-    with open(regexFile, 'r') as stream:
-        try:
-            output = yaml.load(stream)
-            result = [re.match(pattern, str(string)) for pattern in output]
-            if any(result) is not None:
-                return False
-            return True
-        except yaml.YAMLError as exc:
-            print(exc)
+    if not block:
+        return FileInfo(binary=False, empty=True, encoding=None)
 
+    encoding = detect_encoding(block)
+    return FileInfo(binary=likely_binary(block) or encoding == 'binary', empty=False, encoding=encoding)
 
-def vendored_or_documented(file):
-    if regex_file_match("../vendor.yml", file) and regex_file_match("../documentation.yml", file):
-        return True
-    return False
+
+def vendored_or_documented(file, curdir=None):
+    """
+    :param str file: Path of the file
+    :param str curdir: Project root the vendor and documentation rules are relative to
+    """
+    relpath = os.path.relpath(file, curdir) if curdir else file
+    return get_exclusion_matcher().is_excluded(relpath)
 
 
 def not_valid(fileobj):
-    conditions = [
-        likely_binary(fileobj),
-        encoding_binary(fileobj),
-        empty(fileobj),
-    ]
-    if any(condition == True for condition in conditions):
-        return True
-    else:
-        return False
+    info = inspect_file(fileobj)
+    return info.binary or info.empty
+
+
+def classify_file(item):
+    """
+    Run every strategy for a file. Runs in a worker process.
+    :param tuple item: full path and path relative to the project
+    :return: dict result or None if the file is binary or empty
+    """
+    fullpath, relpath = item
+    info = inspect_file(fullpath)
+    if info.binary or info.empty:
+        return None
 
+    result = {
+        'path': to_posix(relpath),
+        'encoding': info.encoding,
+    }
+    try:
+        result['strategies'] = {strategy.__class__.__name__: strategy.find(fullpath) for strategy in STRATEGIES}
+    except Exception as e:
+        log.debug('Could not classify file `{}`: {}'.format(relpath, e))
+        result['error'] = str(e)
+    return result
 
 
+def _classify_task(task):
+    index, item = task
+    return index, classify_file(item)
 
 
-def find_new_command(curdir, config, files=()):
+def _classify_changed(tasks, jobs, ordered):
+    """
+    :param list tasks: (index, item) tuples
+    :return: iterator of (index, result) tuples
+    """
+    if jobs <= 1 or len(tasks) <= INLINE_CLASSIFY_LIMIT:
+        # forking the workers costs more than classifying a few files
+        for task in tasks:
+            yield _classify_task(task)
+        return
+
+    pool = multiprocessing.Pool(processes=min(jobs, -(-len(tasks) // CLASSIFY_CHUNK_SIZE)))
+    try:
+        imap = pool.imap if ordered else pool.imap_unordered
+        for result in imap(_classify_task, tasks, CLASSIFY_CHUNK_SIZE):
+            yield result
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def classify_files(items, jobs=None, ordered=True, state=None):
+    """
+    Classify files in `jobs` processes, all cores by default. The worker pool is started only
+    if more than INLINE_CLASSIFY_LIMIT files need to be classified.
+    :param items: iterable of (full path, relative path) tuples
+    :param bool ordered: yield results in the order of `items`, otherwise as soon as they are ready
+    :param qordoba.state.FindNewState state: results of unchanged files are taken from it,
+        results of changed files are recorded in it
+    :return: iterator of results, see `classify_file`
+    """
+    jobs = jobs or multiprocessing.cpu_count()
+
+    cached = {}
+    changed = {}
+    tasks = []
+    for index, (fullpath, relpath) in enumerate(items):
+        if state is not None:
+            stat = os.stat(fullpath)
+            if not state.is_changed(relpath, stat):
+                cached[index] = state.get_result(relpath)
+                continue
+            changed[index] = relpath, stat
+        tasks.append((index, (fullpath, relpath)))
+
+    if not ordered:
+        for index in sorted(cached):
+            yield cached.pop(index)
+
+    next_index = 0
+    for index, result in _classify_changed(tasks, jobs, ordered):
+        if index in changed:
+            relpath, stat = changed.pop(index)
+            state.record(relpath, stat, result)
+        if not ordered:
+            yield result
+            continue
+
+        cached[index] = result
+        while next_index in cached:
+            yield cached.pop(next_index)
+            next_index += 1
+
+    for index in sorted(cached):
+        yield cached.pop(index)
+
+
+def write_results(results, output):
+    """
+    Write results as JSON Lines.
+    :return: number of written results
+    """
+    count = 0
+    for result in results:
+        if result is None:
+            continue
+        output.write(json.dumps(result, sort_keys=True) + '\n')
+        output.flush()
+        count += 1
+    return count
+
+
+def find_new_command(curdir, config, files=(), jobs=None, output=None, ordered=True, use_cache=True):
+    """
+    :param int jobs: Number of classifier processes. All cores by default
+    :param str output: Path of the JSON Lines file. Results are printed if not set
+    :param bool ordered: Write results in the walk order
+    :param bool use_cache: Classify only the files changed since the last run
+    """
     api = ProjectAPI(config)
     init_language_storage(api)
+    init_language_index(config)
 
     project = api.get_project()
     source_lang = get_source_language(project)
     pattern = get_push_pattern(config)
+    exclusions = get_exclusion_matcher()
+
+    if files:
+        paths = (validate_path(curdir, file_name, source_lang) for file_name in files)
+    else:
+        # vendored and documentation folders are pruned during the walk
+        paths = find_files_by_patterns(curdir, pattern, source_lang, project['content_type_codes'],
+                                       exclude_dir=exclusions.exclude_dir)
+
+    found = []
+
+    def candidates():
+        for path in paths:
+            if not exclusions.is_excluded(path.relpath):
+                found.append(path.relpath)
+                yield path.fullpath, path.relpath
+
+    state = FindNewState(curdir) if use_cache else None
+    results = classify_files(candidates(), jobs=jobs, ordered=ordered, state=state)
+
+    try:
+        if output is None:
+            count = write_results(results, sys.stdout)
+        else:
+            with io.open(output, 'w', encoding='utf-8') as f:
+                count = write_results(results, f)
 
-    if not files:
-        files = list(find_files_by_pattern(curdir, pattern, source_lang))
+        if state is not None and not files:
+            state.retain(found)
+    finally:
+        if state is not None:
+            state.save()
 
-        if not files:
-            raise FilesNotFound('Files not found by pattern `{}`'.format(pattern))
+    if not found:
+        raise FilesNotFound('Files not found by pattern `{}`'.format(pattern))
 
-    for file_name in files:
-        blob = curdir + '/' + ''.join(pattern.split('/')[:-1]) +  '/' + str(file_name)
-        if not vendored_or_documented(blob) and not not_valid(blob):
-            language = [strategy.find(blob) for strategy in STRATEGIES]
-            RESULTS.append(language)
-        print(RESULTS)
+    log.info('Classified {} of {} files'.format(count, len(found)))
+    return count
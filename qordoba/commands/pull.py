@@ -1,26 +1,33 @@
 from __future__ import unicode_literals, print_function
 
-import errno
 import logging
 import os
 import shutil
+import tempfile
+import zipfile
 from argparse import ArgumentTypeError
-import requests, zipfile
-# from mock.mock import self
-
-try:
-    import StringIO
-except ImportError:
-    import io
+from collections import OrderedDict, namedtuple
 
 from qordoba.commands.utils import mkdirs, ask_select, ask_question
 from qordoba.languages import get_destination_languages, get_source_language, init_language_storage, normalize_language
-from qordoba.project import ProjectAPI, PageStatus
+from qordoba.project import ProjectAPI, PageStatus, QordobaResponseError
 from qordoba.settings import get_pull_pattern
 from qordoba.sources import create_target_path_by_pattern
+from qordoba.state import PullState, DownloadJournal, replace_file
+from qordoba.utils import run_parallel
 
 log = logging.getLogger('qordoba')
 
+BULK_DOWNLOAD_DIR = 'bulkDownload'
+
+PART_SUFFIX = '.part'
+
+
+class DownloadIncomplete(Exception):
+    """
+    Connection was closed before the whole file was received
+    """
+
 
 def format_file_name(page):
     if page.get('version_tag'):
@@ -55,6 +62,195 @@ class MilestoneOptions(object):
         return tuple(milestone_list)
 
 
+class DownloadTask(namedtuple('_DownloadTask', ('page', 'page_id', 'language', 'milestone', 'dest_path'))):
+    """
+    Single translation file download planned by `pull_command`
+    """
+
+
+class PageDetailsCache(object):
+    """
+    Page details used by the pull planner, fetched once per run.
+
+    Name, version tag and content type code of a page are the same in every language, so when only
+    those are needed (`per_language=False`) a page is fetched once for all languages. Milestone status
+    and assignees differ by language and are fetched per (language, page). Missing details of a page
+    listing are requested `jobs` at a time.
+    """
+
+    def __init__(self, api, jobs=1):
+        self._api = api
+        self._jobs = jobs
+        self._details = {}
+        self._pages = {}
+
+    def _fetch(self, key):
+        language_id, page_id = key
+        return key, self._api.get_page_details(language_id, page_id)
+
+    def _missing(self, language, page_ids, per_language):
+        keys = []
+        for page_id in page_ids:
+            key = (language.id, page_id)
+            if key in self._details or (not per_language and page_id in self._pages) or key in keys:
+                continue
+            keys.append(key)
+        return keys
+
+    def prefetch(self, language, pages, per_language=True):
+        """
+        :param qordoba.languages.Language language:
+        :param pages: Pages from `page_search` response
+        """
+        keys = self._missing(language, [page['page_id'] for page in pages], per_language)
+        for key, details in run_parallel(self._fetch, keys, jobs=min(self._jobs, len(keys) or 1)):
+            self._details[key] = details
+            self._pages.setdefault(key[1], details)
+
+    def get(self, language, page_id, per_language=True):
+        key = (language.id, page_id)
+        if key not in self._details and (per_language or page_id not in self._pages):
+            self.prefetch(language, [{'page_id': page_id}], per_language=per_language)
+
+        if per_language:
+            return self._details[key]
+        return self._details.get(key) or self._pages[page_id]
+
+
+class LanguagePageIndex(object):
+    """
+    Page listings of every language, searched once per run and matched against every pull pattern.
+    """
+
+    def __init__(self, api, statuses, jobs=1):
+        """
+        :param list statuses: Status filters. Every filter is a separate `page_search` listing
+        """
+        self._api = api
+        self._statuses = []
+        for status in statuses:
+            if status not in self._statuses:
+                self._statuses.append(status)
+        self._jobs = jobs
+        self._listings = {}
+
+    def _search(self, key):
+        language_id, i = key
+        return key, list(self._api.page_search(language_id, status=self._statuses[i]))
+
+    def prefetch(self, languages):
+        keys = [(language.id, i) for language in languages for i in range(len(self._statuses))
+                if (language.id, i) not in self._listings]
+        for key, pages in run_parallel(self._search, keys, jobs=min(self._jobs, len(keys) or 1)):
+            self._listings[key] = pages
+
+    def get(self, language):
+        """
+        :return: list of page listings, one per status filter
+        """
+        self.prefetch([language])
+        return [self._listings[(language.id, i)] for i in range(len(self._statuses))]
+
+
+def _journal_params(task):
+    return {
+        'page_id': task.page_id,
+        'language_id': task.language.id,
+        'milestone': task.milestone,
+        'update': task.page.get('update'),
+    }
+
+
+def resume_download(api, task, journal, key, part_path):
+    """
+    Continue journaled download of the task if its partial file exists.
+    :return: tuple of the response and the offset to write from. (None, 0) if download can't be resumed.
+    """
+    entry = journal.get(key) if journal is not None else None
+    if not entry or not os.path.exists(part_path):
+        return None, 0
+
+    if any(entry.get(k) != v for k, v in _journal_params(task).items()):
+        return None, 0
+
+    offset = os.path.getsize(part_path)
+    try:
+        res = api.resume_download(entry['url'], offset)
+    except QordobaResponseError as e:
+        log.debug('Could not resume download of `{}`: {}'.format(task.dest_path.native_path, e))
+        return None, 0
+
+    if res.status_code != 206:
+        # range is not supported. The whole file is sent again
+        return res, 0
+
+    content_range = res.headers.get('Content-Range', '')
+    if not content_range.startswith('bytes {}-'.format(offset)):
+        res.close()
+        return None, 0
+
+    log.info('Resuming download of `{}` from byte {}'.format(task.dest_path.native_path, offset))
+    return res, offset
+
+
+def download_task(api, task, journal=None):
+    """
+    Download translation file for planned task. Safe to run in a worker thread.
+
+    The file is written to `<dest>.part` and renamed once complete. With a journal the download
+    URL is kept until then, so an interrupted download is resumed by the next pull.
+    :type task: DownloadTask
+    :type journal: qordoba.state.DownloadJournal
+    """
+    dest = task.dest_path.native_path
+    part_path = dest + PART_SUFFIX
+    key = task.dest_path.posix_path
+
+    dest_dir = os.path.dirname(dest)
+    if dest_dir and not os.path.exists(dest_dir):
+        log.debug('Creating folder path {}'.format(dest_dir))
+        mkdirs(dest_dir)
+
+    res, offset = resume_download(api, task, journal, key, part_path)
+    if res is None:
+        res = api.download_file(task.page_id, task.language.id, milestone=task.milestone)
+        if journal is not None:
+            journal.start(key, res.url, **_journal_params(task))
+
+    res.raw.decode_content = True  # required to decompress content
+
+    with open(part_path, 'ab' if offset else 'wb') as f:
+        start = f.tell()
+        shutil.copyfileobj(res.raw, f)
+        written = f.tell() - start
+
+    content_length = res.headers.get('Content-Length')
+    if content_length and not res.headers.get('Content-Encoding') and written != int(content_length):
+        raise DownloadIncomplete('Download of `{}` was interrupted after {} of {} bytes. Run pull again to resume it.'
+                                 .format(dest, offset + written, offset + int(content_length)))
+
+    replace_file(part_path, dest)
+    if journal is not None:
+        journal.finish(key)
+
+    return task
+
+
+def download_tasks(api, tasks, jobs=1, state=None, journal=None):
+    """
+    Run planned downloads, `jobs` at a time. Results are logged in the planned order.
+    :param qordoba.state.PullState state: records every finished download
+    :param qordoba.state.DownloadJournal journal: keeps downloads in progress
+    """
+    for task in run_parallel(lambda t: download_task(api, t, journal=journal), tasks, jobs=jobs):
+        if state is not None:
+            state.record(task.page, task.language, task.milestone, task.dest_path)
+        log.info(
+            'Downloaded translation file `{}` for src `{}` and language `{}`'.format(task.dest_path.native_path,
+                                                                                 format_file_name(task.page),
+                                                                                 task.language.code))
+
+
 def validate_languges_input(languages, project_languages):
     selected_langs = set()
     for l in languages:
@@ -68,36 +264,91 @@ def validate_languges_input(languages, project_languages):
     return list(selected_langs)
 
 
-def pull_bulk(api, src_to_dest_paths, dest_languages_page_ids, dest_languages_ids, pattern):
+def get_bulk_destinations(src_to_dest_paths):
+    """
+    Map archive members to the files built from the pull pattern.
+    :param src_to_dest_paths: iterable of (language code, source file name, destination path) tuples
+    :return: dict of (language code, source file name) to destination path.
+        None if the member is claimed by different destinations
+    """
+    destinations = {}
+    for language_code, source_name, dest_path in src_to_dest_paths:
+        key = (language_code.lower(), source_name)
+        if key in destinations and destinations[key] != dest_path:
+            dest_path = None
+        destinations[key] = dest_path
+    return destinations
+
+
+def _inside(path, base_dir):
+    return not os.path.relpath(path, base_dir).startswith(os.pardir)
+
+
+def extract_bulk_archive(archive, root, destinations, overwrite=False):
+    """
+    Extract archive members one by one. Members are expected to be stored as `<language_code>/<path>`.
+    Members without a destination, or whose destination exists and `overwrite` is not set, are
+    extracted to `root`.
+    :param zipfile.ZipFile archive:
+    :param str root: Folder for members without destination
+    :param dict destinations: see `get_bulk_destinations`
+    """
+    for member in archive.infolist():
+        if member.filename.endswith('/'):
+            continue
+
+        language_code, _, member_path = member.filename.partition('/')
+        code = language_code.lower()
+        target_path = destinations.get((code, member_path)) or \
+            destinations.get((code, member_path.rpartition('/')[2]))
+
+        if target_path is not None and os.path.exists(target_path) and not overwrite:
+            log.warning('Translation file already exists. `{}`. Saved to `{}` instead.'.format(target_path, root))
+            target_path = None
+
+        if target_path is None:
+            target_path = os.path.normpath(os.path.join(root, member.filename))
+            if not _inside(target_path, root):
+                log.warning('Archive member `{}` is outside of the destination folder. Skipped.'
+                            .format(member.filename))
+                continue
+
+        mkdirs(os.path.dirname(target_path))
+        with archive.open(member) as src, open(target_path, 'wb') as dest:
+            shutil.copyfileobj(src, dest)
+
+        log.debug('Extracted `{}` to `{}`'.format(member.filename, target_path))
+
+
+def pull_bulk(api, src_to_dest_paths, dest_languages_page_ids, dest_languages_ids, pattern, overwrite=False):
+    """
+    :param src_to_dest_paths: see `get_bulk_destinations`
+    :param bool overwrite: Replace existing files
+    """
     log.info('Starting bulk download for all files and languages in project')
 
     # making request to our internal api: export_files_bulk (POST). This request downloads all files for given language
     res = api.download_files(dest_languages_page_ids, dest_languages_ids)
 
-    # the api return a url and accesstoken for the Google Cloud server where Qordoba saves the translated files
-    r = requests.get(res, stream=True)
+    root = os.path.join(os.getcwd(), BULK_DOWNLOAD_DIR)
 
-    # unzipping the returned zipfile for python2 or python3
-    try:
-        z = zipfile.ZipFile(StringIO.StringIO(r.content))
-    except:
-        z = zipfile.ZipFile(io.BytesIO(r.content))
+    # the api return a url and accesstoken for the Google Cloud server where Qordoba saves the translated files.
+    # The archive is streamed to a temporary file, so it is never loaded to memory
+    with tempfile.TemporaryFile() as f:
+        log.info('Downloading files...')
+        api.stream_file(res, f)
+        f.seek(0)
 
-    if not os.path.exists('bulkDownload'):
-        os.makedirs('bulkDownload')
+        with zipfile.ZipFile(f) as archive:
+            extract_bulk_archive(archive, root, get_bulk_destinations(src_to_dest_paths), overwrite=overwrite)
 
-    # extract zip folder to root folder
-    log.info('Downloading files...')
-    root = os.getcwd() + '/' + 'bulkDownload'
-    zip_files = z.namelist()
-    z.extractall(root, zip_files)
-
-    log.info('Finished with bulk download. Saved in "qordoba-cli/qordoba/bulkDownload/"')
+    log.info('Finished with bulk download.')
 
 
 def pull_command(curdir, config, files=(), force=False, bulk=False, workflow=False, workflow_all=None, version=None, distinct=False, languages=(),
-                 in_progress=False, update_action=None, custom=False, **kwargs):
+                 in_progress=False, update_action=None, custom=False, jobs=1, incremental=False, **kwargs):
     api = ProjectAPI(config)
+    state = PullState(curdir)
     init_language_storage(api)
     project = api.get_project()
     dest_languages = list(get_destination_languages(project))
@@ -112,36 +363,57 @@ def pull_command(curdir, config, files=(), force=False, bulk=False, workflow=Fal
     src_language_id = src_language.id
     dest_languages_page_ids = []
     dest_languages_ids = [src_language_id]
-    src_to_dest_paths = []
 
     pattern_list = get_pull_pattern(config, default=None)
     if pattern_list is None:
         pattern_list = [None]
 
+    # all prompts are answered while planning, so the downloads can run in parallel afterwards.
+    # One task per destination, a later task replaces the earlier one like the sequential download did
+    tasks = OrderedDict()
+    page_details = PageDetailsCache(api, jobs=jobs)
+
+    status_filter = [PageStatus.enabled, ]
+    # generally only completed files will be pulled
+    if in_progress is False:
+        log.debug('Pull only completed translations.')
+        status_filter = [PageStatus.completed, ]
+    statuses = [status_filter, ]
+    # if workflow flag exists, enabled files will be pulled too
+    if workflow or workflow_all:
+        statuses.append([PageStatus.enabled, ])
+
+    # pages are searched once per language and matched against every pattern
+    page_index = LanguagePageIndex(api, statuses, jobs=jobs)
+    page_index.prefetch(languages)
+    # bulk download doesn't use milestones, so language specific details are needed for workflow only
+    per_language_details = not bulk or bool(workflow or workflow_all)
+    # details of pages not updated since the last incremental pull are taken from the state.
+    # Workflow needs the assignees, which are not kept
+    use_state_details = incremental and not bulk and not (workflow or workflow_all)
+
     # based on the configuration in .qordoba.yml the destination for the pulled files will be set. Default path is '.qordoba-cli/qordoba/'
     for pattern in pattern_list:
+        src_to_dest_paths = []
         for language in languages:
-            status_filter = [PageStatus.enabled, ]
-
-            # generally only completed files will be pulled
-            if in_progress is False:
-                log.debug('Pull only completed translations.')
-                status_filter = [PageStatus.completed, ]
-
             is_started = False
-            pages_completed = api.page_search(language.id, status=status_filter)
-            pages_all = [pages_completed, ]
-
-            # if workflow flag exists, enabled files will be pulled too
-            if workflow or workflow_all:
-                pages_enabled = api.page_search(language.id, status=[PageStatus.enabled, ])
-                pages_all = [pages_completed, pages_enabled]
-
             milestone_all = None
-            for pages in pages_all:
+            for pages in page_index.get(language):
+                known_details = {}
+                if use_state_details:
+                    for page in pages:
+                        details = state.get_details(page, language)
+                        if details is not None:
+                            known_details[page['page_id']] = details
+                page_details.prefetch(language, [page for page in pages if page['page_id'] not in known_details],
+                                      per_language=per_language_details)
                 for page in pages:
                     is_started = True
-                    page_status = api.get_page_details(language.id, page['page_id'], )
+                    page_status = known_details.get(page['page_id'])
+                    if page_status is None:
+                        page_status = page_details.get(language, page['page_id'], per_language=per_language_details)
+                        if per_language_details:
+                            state.record_details(page, language, page_status)
                     dest_languages_page_ids.append(page['page_id'])
                     dest_languages_ids.append(language.id)
                     milestone = page_status['status']['id']
@@ -200,26 +472,21 @@ def pull_command(curdir, config, files=(), force=False, bulk=False, workflow=Fal
                                                               content_type_code=page_status['content_type_code'],
                                                               )
 
-                    if pattern is not None:
-                        stripped_dest_path = ((dest_path.native_path).rsplit('/', 1))[0]
-                        src_to_dest_paths.append(tuple((language.code, stripped_dest_path)))
-                    src_to_dest_paths.append(tuple((language.code, language.code)))
-
-                    # adding the src langauge to the dest_path_of_src_language pattern
-                    dest_path_of_src_language = create_target_path_by_pattern(curdir,
-                                                                              src_language,
-                                                                              pattern=pattern,
-                                                                              distinct=distinct,
-                                                                              version_tag=page_status['version_tag'],
-                                                                              source_name=page_status['name'],
-                                                                              content_type_code=page_status[
-                                                                                  'content_type_code'],
-                                                                              )
-
-                    if pattern is not None:
-                        stripped_dest_path_of_src_language = ((dest_path_of_src_language.native_path).rsplit('/', 1))[0]
-                        src_to_dest_paths.append(tuple((src_language_code, stripped_dest_path_of_src_language)))
-                    src_to_dest_paths.append(tuple((src_language_code, src_language_code)))
+                    if bulk and pattern is not None:
+                        # adding the src language, the archive contains the source files too
+                        dest_path_of_src_language = create_target_path_by_pattern(curdir,
+                                                                                  src_language,
+                                                                                  pattern=pattern,
+                                                                                  distinct=distinct,
+                                                                                  version_tag=page_status['version_tag'],
+                                                                                  source_name=page_status['name'],
+                                                                                  content_type_code=page_status[
+                                                                                      'content_type_code'],
+                                                                                  )
+                        for source_name in {page_status['name'], page['url']}:
+                            src_to_dest_paths.append((language.code, source_name, dest_path.fullpath))
+                            src_to_dest_paths.append((src_language_code, source_name,
+                                                      dest_path_of_src_language.fullpath))
 
                     if not bulk:
                         """
@@ -232,12 +499,17 @@ def pull_command(curdir, config, files=(), force=False, bulk=False, workflow=Fal
                         if not custom and pattern and valid_extension != "<extension>" and valid_extension != file_extension:
                             continue
 
+                        if incremental and not state.is_changed(page, language, milestone, dest_path):
+                            log.debug('Translation file `{}` is up to date.'.format(dest_path.native_path))
+                            continue
+
 
                         log.info(
                             'Starting Download of translation file(s) for src `{}`, language `{}` and pattern {}'.format(
                                 format_file_name(page), language.code, pattern))
 
-                        if os.path.exists(dest_path.native_path) and not force:
+                        if (os.path.exists(dest_path.native_path) or dest_path.native_path in tasks) \
+                                and not force:
                             log.warning('Translation file already exists. `{}`'.format(dest_path.native_path))
                             answer = FileUpdateOptions.get_action(update_action) or ask_select(FileUpdateOptions.all,
                                                                                                prompt='Choice: ')
@@ -246,7 +518,7 @@ def pull_command(curdir, config, files=(), force=False, bulk=False, workflow=Fal
                                 log.info('Download translation file `{}` was skipped.'.format(dest_path.native_path))
                                 continue
                             elif answer == FileUpdateOptions.new_name:
-                                while os.path.exists(dest_path.native_path):
+                                while os.path.exists(dest_path.native_path) or dest_path.native_path in tasks:
                                     dest_path = ask_question('Set new filename: ', answer_type=dest_path.replace)
                                     # pass to replace file
 
@@ -256,28 +528,20 @@ def pull_command(curdir, config, files=(), force=False, bulk=False, workflow=Fal
                             assert milestone_dict[workflow_all] == milestone
                             log.info('- note: pulls only from workflowstep  `{}` '.format(workflow_all))
 
-                        res = api.download_file(page_status['id'], language.id, milestone=milestone)
-                        res.raw.decode_content = True  # required to decompress content
-
-                        if not os.path.exists(os.path.dirname(dest_path.native_path)):
-                            try:
-                                os.makedirs(os.path.dirname(dest_path.native_path))
-                                log.info("Creating folder path {}".format(dest_path.native_path))
-                            except OSError as exc:  # Guard against race condition
-                                if exc.errno != errno.EEXIST:
-                                    pass
-
-                        with open(dest_path.native_path, 'wb') as f:
-                            shutil.copyfileobj(res.raw, f)
+                        tasks.pop(dest_path.native_path, None)
+                        tasks[dest_path.native_path] = DownloadTask(page, page_status['id'], language, milestone,
+                                                                    dest_path)
 
-                        log.info(
-                            'Downloaded translation file `{}` for src `{}` and language `{}`'.format(dest_path.native_path,
-                                                                                                     format_file_name(page),
-                                                                                                 language.code))
             if not is_started and not bulk:
                 log.info(
                     'Nothing to download for language `{}`. Check if your file translation status is `completed`.'.format(
                         language.code))
 
         if bulk:
-            pull_bulk(api, src_to_dest_paths, dest_languages_page_ids, dest_languages_ids, pattern=pattern)
+            pull_bulk(api, src_to_dest_paths, dest_languages_page_ids, dest_languages_ids, pattern=pattern,
+                      overwrite=force or update_action == 'replace')
+
+    try:
+        download_tasks(api, list(tasks.values()), jobs=jobs, state=state, journal=DownloadJournal(curdir))
+    finally:
+        state.save()
@@ -1,21 +1,51 @@
 from __future__ import unicode_literals, print_function
 
 import logging
-import os
 from qordoba.commands.utils import ask_question, ask_select_multiple, ask_select
 from qordoba.languages import get_source_language, init_language_storage, get_destination_languages
 from qordoba.project import ProjectAPI
 from qordoba.settings import get_push_pattern, get_project_file_formats
-from qordoba.sources import find_files_by_pattern, validate_path, validate_push_pattern, get_content_type_code, \
-    get_mimetype, add_project_file_formats
+from qordoba.sources import find_files_by_patterns, validate_path, validate_push_pattern, get_content_type_code, \
+    get_mimetype, add_project_file_formats, ContentTypeResolver
+from qordoba.state import PushState
+from qordoba.utils import run_parallel
 
 log = logging.getLogger('qordoba')
 
+APPEND_BATCH_SIZE = 50
+
 class FilesNotFound(Exception):
     """
     Files not found
     """
 
+class RemotePageIndex(object):
+    """
+    Pages of the project by exact file name. The page listing is fetched on first lookup,
+    once for the whole push.
+    """
+
+    def __init__(self, api, language_id):
+        self._api = api
+        self._language_id = language_id
+        self._pages = None
+
+    def _load(self):
+        pages = {}
+        for page in self._api.page_search(language_id=self._language_id):
+            pages.setdefault(page['url'], []).append(page)
+        log.debug('Found {} remote files'.format(len(pages)))
+        return pages
+
+    def find(self, file_name):
+        """
+        :return: list of pages named `file_name`, one per version tag
+        """
+        if self._pages is None:
+            self._pages = self._load()
+        return self._pages.get(file_name, [])
+
+
 def select_version_tag(file_name, version_tags):
     log.info('File `{}` already exists with tags {}. Please setup new version tag:'
              .format(file_name, ', '.join(version_tags)))
@@ -83,33 +113,99 @@ def select_source_columns(columns):
     }
 
 
-def upload_file(api, path, remote_content_type_codes, version=None, **kwargs):
+def send_file(api, path, remote_content_type_codes, **kwargs):
+    """
+    Upload file content. The file is not attached to the project until `append_files` is called.
+    Safe to run in a worker thread.
+    :return: upload response
+    """
     log.info('Uploading {}'.format(path.native_path))
 
     file_name = path.unique_name
     content_type_code = get_content_type_code(path, remote_content_type_codes)
-    version_tag = version
 
     with open(path.native_path, 'rb') as f:
         resp = api.upload_anytype_file(f, file_name, content_type_code, mimetype=get_mimetype(content_type_code),
                                        **kwargs)
     log.debug('File `{}` uploaded. Name - `{}`. Adding to the project...'.format(path.native_path, file_name))
+    return resp
+
+
+def get_append_params(path, resp, version=None):
+    """
+    Ask user for the version tag and the source columns required to attach uploaded file.
+    :return: dict of `append_file` params
+    """
+    file_name = path.unique_name
+    version_tag = version
 
     # if resp.get('version_tags') or resp.get('version_tags') == []:
     if resp.get('version_tags', ()):
         if version_tag is None or version_tag == 'None' or version_tag in resp.get('version_tags'):
             version_tag = select_version_tag(file_name, resp.get('version_tags'))
 
+    params = {'version_tag': version_tag}
     if resp.get('columns'):
-        kwargs.update(select_source_columns(resp.get('columns')))
+        params.update(select_source_columns(resp.get('columns')))
 
-    resp = api.append_file(resp['upload_id'], file_name, version_tag=version_tag, **kwargs)
+    return params
 
+
+def log_uploaded(path, version_tag, version=None):
     if version:
-        log.info('Uploaded {} successfully as {} with version tag `{}`'.format(path.native_path, file_name, version_tag))
+        log.info('Uploaded {} successfully as {} with version tag `{}`'.format(path.native_path, path.unique_name,
+                                                                              version_tag))
     else:
-        log.info('Uploaded {} successfully as {}'.format(path.native_path, file_name))
+        log.info('Uploaded {} successfully as {}'.format(path.native_path, path.unique_name))
+
+
+def upload_file(api, path, remote_content_type_codes, version=None, **kwargs):
+    resp = send_file(api, path, remote_content_type_codes, **kwargs)
+
+    kwargs.update(get_append_params(path, resp, version=version))
+    api.append_file(resp['upload_id'], path.unique_name, **kwargs)
 
+    log_uploaded(path, kwargs['version_tag'], version=version)
+
+
+def get_appended_page_ids(resp, count):
+    """
+    Page IDs from `append_files` response, in the order of the appended files.
+    The response is a list of pages or a dict with the list under `files` or `pages`.
+    :param int count: Number of appended files
+    :return: list of page IDs. None where the response has no page ID
+    """
+    items = resp
+    if isinstance(resp, dict):
+        items = resp.get('files') or resp.get('pages')
+    if not isinstance(items, list) or len(items) != count:
+        return [None] * count
+    return [item.get('page_id') if isinstance(item, dict) else None for item in items]
+
+
+def upload_files(api, paths, remote_content_type_codes, version=None, jobs=1, batch_size=APPEND_BATCH_SIZE):
+    """
+    Upload files in parallel, then attach them to the project with batched `append_files` requests.
+    :return: iterator of (path, page ID) tuples, yielded once the batch of the path is appended.
+        Files of the batches appended before a failed one are yielded before the error is raised
+    """
+    uploads = list(run_parallel(lambda path: (path, send_file(api, path, remote_content_type_codes)),
+                                paths, jobs=jobs))
+
+    # questions are asked in the main thread once all uploads are done
+    appends = []
+    for path, resp in uploads:
+        params = get_append_params(path, resp, version=version)
+        params.update(upload_id=resp['upload_id'], file_name=path.unique_name)
+        appends.append((path, params))
+
+    for start in range(0, len(appends), batch_size):
+        batch = appends[start:start + batch_size]
+        resp = api.append_files([params for _, params in batch])
+
+        for (path, params), page_id in zip(batch, get_appended_page_ids(resp, len(batch))):
+            log_uploaded(path, params['version_tag'], version=version)
+            yield path, page_id
 
 
 def update_file(api, path, remote_files, version=None):
@@ -129,44 +225,63 @@ def update_file(api, path, remote_files, version=None):
     resp = api.apply_upload_file(resp['id'], remote_file['page_id'])
 
     log.info('Updated {} successfully.'.format(file_name))
+    return remote_file['page_id']
 
-def find_directories(pattern):
-    directory = pattern.split('/')
-    del directory[-1]
-    directory = '/'.join(directory) + '/'
-    directory_list = list()
-    directory_list.append(directory)
-    directory_listing = [x[0] for x in os.walk(directory)]
-    return directory_listing
-
-def final_push(project, curdir, pattern, api,  update, version, remote_content_type_codes):
-
+def push_files(project, curdir, files, api, update, version, remote_content_type_codes, jobs=1, state=None,
+               force=False, page_index=None):
+    """
+    Update files which exist in the project, upload the new ones.
+    :param list files: TranslationFile objects or paths
+    """
     source_lang = get_source_language(project)
-    lang = next(get_destination_languages(project))
-    files = list(find_files_by_pattern(curdir, pattern, source_lang, remote_content_type_codes))
-
-    if len(files) == 0:
-        log.info('Files for the given push pattern `{}` do not exists.' .format(pattern))
+    if page_index is None:
+        page_index = RemotePageIndex(api, next(get_destination_languages(project)).id)
 
+    updates = []
+    uploads = []
     for file in files:
         path = validate_path(curdir, file, source_lang)
 
         file_name = path.unique_name
 
-        remote_file_pages = list(api.page_search(language_id=lang.id, search_string=file_name))
+        if state is not None and not force and not state.is_changed(path, version=version):
+            log.info('File {} was not changed since last push. Skipped.'.format(path.native_path))
+            continue
+
+        page_id = state.get_page_id(path, version=version) if state is not None else None
+        if page_id is not None:
+            remote_file_pages = [{'page_id': page_id, 'version_tag': version}, ]
+        else:
+            remote_file_pages = page_index.find(file_name)
 
         if remote_file_pages and update:
-            update_file(api, path, remote_file_pages, version=version)
+            updates.append((path, remote_file_pages))
         else:
-            upload_file(api, path, remote_content_type_codes, version=version)
+            uploads.append(path)
 
+    updated = run_parallel(lambda item: (item[0], update_file(api, item[0], item[1], version=version)),
+                           updates, jobs=jobs)
+    for path, page_id in updated:
+        if state is not None:
+            state.record(path, page_id=page_id, version=version)
 
-def push_command(curdir, config, update, version=None, files=()):
+    if uploads:
+        # every appended batch is recorded at once, so a failed batch doesn't lose the earlier ones
+        for path, page_id in upload_files(api, uploads, remote_content_type_codes, version=version, jobs=jobs):
+            if state is not None:
+                state.record(path, page_id=page_id, version=version)
+
+
+def push_command(curdir, config, update, version=None, files=(), jobs=1, force=False):
     api = ProjectAPI(config)
     project = api.get_project()
-    remote_content_type_codes = project['content_type_codes']
+    state = PushState(curdir, project['id'])
     init_language_storage(api)
-    add_project_file_formats(get_project_file_formats(config))
+    file_formats = get_project_file_formats(config)
+    add_project_file_formats(file_formats)
+    # extension lookup is built once and passed down instead of the raw content type codes
+    remote_content_type_codes = ContentTypeResolver(project['content_type_codes'], file_formats=file_formats)
+    page_index = RemotePageIndex(api, next(get_destination_languages(project)).id)
 
     if not files:
         pattern_list = get_push_pattern(config)
@@ -179,13 +294,14 @@ def push_command(curdir, config, update, version=None, files=()):
         for file_ in files:
             pattern_list.append(file_)
 
-    for pattern in pattern_list:
-        assert len(pattern_list) != 0
-        if pattern[-2:] == '/*':
-            pattern_extension = pattern.split('/')[-1]
-            directory_list = find_directories(pattern)
-            for dir_ in directory_list:
-                dir_ = dir_ + '/' + pattern_extension
-                final_push(project, curdir, dir_, api,  update, version, remote_content_type_codes)
-        else:
-            final_push(project, curdir, pattern, api, update, version, remote_content_type_codes)
\ No newline at end of file
+    # all patterns are matched in one walk of the project, every file is pushed once
+    files = list(find_files_by_patterns(curdir, pattern_list, get_source_language(project),
+                                        remote_content_type_codes))
+    if not files:
+        log.info('Files for the given push patterns `{}` do not exists.'.format(', '.join(pattern_list)))
+
+    try:
+        push_files(project, curdir, files, api, update, version, remote_content_type_codes, jobs=jobs,
+                   state=state, force=force, page_index=page_index)
+    finally:
+        state.save()
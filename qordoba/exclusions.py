@@ -0,0 +1,82 @@
+from __future__ import unicode_literals, print_function
+
+import logging
+import os
+import re
+
+import yaml
+
+from qordoba.sources import to_posix
+
+log = logging.getLogger('qordoba')
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+VENDOR_RULES_PATH = os.path.join(PACKAGE_DIR, 'vendor.yml')
+
+DOCUMENTATION_RULES_PATH = os.path.join(PACKAGE_DIR, 'documentation.yml')
+
+
+def load_rules(path):
+    """
+    :param str path: YAML file with a list of regular expressions
+    :rtype: list
+    """
+    with open(path, 'r') as f:
+        return yaml.safe_load(f) or []
+
+
+class ExclusionMatcher(object):
+    """
+    Vendored and documentation path rules compiled into one regular expression.
+
+    Rules are searched in the posix form of the path relative to the project root,
+    folders end with a slash. Rules python can't compile are skipped.
+    """
+
+    def __init__(self, rules):
+        valid_rules = []
+        for rule in rules:
+            try:
+                re.compile(rule)
+            except re.error as e:
+                log.debug('Exclusion rule `{}` ignored: {}'.format(rule, e))
+                continue
+            valid_rules.append('(?:{})'.format(rule))
+
+        self.rules_count = len(valid_rules)
+        self._regexp = re.compile('|'.join(valid_rules)) if valid_rules else None
+
+    @classmethod
+    def from_files(cls, *paths):
+        rules = []
+        for path in paths:
+            rules.extend(load_rules(path))
+        return cls(rules)
+
+    def is_excluded(self, relpath, is_dir=False):
+        if self._regexp is None:
+            return False
+        path = to_posix(relpath)
+        if is_dir and not path.endswith('/'):
+            path += '/'
+        return self._regexp.search(path) is not None
+
+    def exclude_dir(self, relpath, name=None):
+        """
+        Folder predicate for `qordoba.sources.walk_project`
+        """
+        return self.is_excluded(relpath, is_dir=True)
+
+
+_MATCHER = None
+
+
+def get_exclusion_matcher():
+    """
+    Matcher of the vendor and documentation rules shipped with the package, loaded once.
+    """
+    global _MATCHER
+    if _MATCHER is None:
+        _MATCHER = ExclusionMatcher.from_files(VENDOR_RULES_PATH, DOCUMENTATION_RULES_PATH)
+    return _MATCHER
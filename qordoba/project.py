@@ -2,11 +2,16 @@ from __future__ import unicode_literals, print_function
 
 import json
 import functools
+import threading
 
 import logging
 import requests
+from requests.adapters import HTTPAdapter
 
-from qordoba.utils import build_url
+from qordoba.cache import ResponseCache, DEFAULT_CACHE_DIR, make_key
+from qordoba.scheduler import RequestScheduler
+from qordoba.settings import get_http_settings, get_cache_settings
+from qordoba.utils import build_url, run_parallel
 
 try:
     from json import JSONDecodeError
@@ -21,6 +26,8 @@ API_URL = 'https://app.qordoba.com/api/'
 
 DEFAULT_MILESTONE_ID = -100
 
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
 
 class QordobaResponseError(Exception):
     """
@@ -45,24 +52,31 @@ class FileAlreadyExistResponse(QordobaResponseError):
     pass
 
 
-def exception_from_response(resp):
+def exception_from_content(content, method, url):
+    """
+    :param bytes content: Body of the error response
+    """
     error_cls = QordobaResponseError
 
     try:
-        data = resp.json()
+        data = json.loads(content.decode('utf-8'))
 
         if 'already exist' in data.get('errMessage'):
             error_cls = FileAlreadyExistResponse
 
-    except (TypeError, JSONDecodeError, ValueError):
-        if resp.content:
-            data = resp.content.decode('utf-8')
+    except (TypeError, AttributeError, JSONDecodeError, ValueError):
+        if content:
+            data = content.decode('utf-8')
         else:
-            data = 'An error occurred while making a {} request to {}'.format(resp.request.method, resp.request.url)
+            data = 'An error occurred while making a {} request to {}'.format(method, url)
 
     return error_cls(data)
 
 
+def exception_from_response(resp):
+    return exception_from_content(resp.content, resp.request.method, resp.request.url)
+
+
 class PageStatus:
     enabled = 'enabled'
     completed = 'completed'
@@ -71,7 +85,14 @@ class PageStatus:
 
 
 class ResponsePaginatedResult(object):
-    def __init__(self, source_name, func, args, kwargs):
+    """
+    Lazy list of records from a paginated endpoint.
+
+    Once the first response tells the total number of results, the remaining pages are
+    requested by `workers` threads at once. Records are still yielded in the server order.
+    """
+
+    def __init__(self, source_name, func, args, kwargs, workers=1):
         self._source_name = source_name
 
         self._func = func
@@ -80,19 +101,40 @@ class ResponsePaginatedResult(object):
         self._limit = kwargs.get('limit', 50)
         self._offset = kwargs.get('offset', 0)
         self._next_offset = 0
+        self._workers = workers
 
         self._total_result = None
         self._result = []
 
-    def request_next(self):
+    def _request(self, offset):
         kwargs = {k: v for k, v in self._nativa_kwargs.items()}
-        kwargs['offset'] = self._next_offset
-        result = self._func(*self._nativa_args, **kwargs)
-        self._result.extend(result[self._source_name])
+        kwargs['offset'] = offset
+        return self._func(*self._nativa_args, **kwargs)
+
+    def _add_result(self, result):
+        records = result[self._source_name]
+        self._result.extend(records)
         self._total_result = result['meta']['paging']['total_results']
+        if not records:
+            # nothing more to fetch, even if total_results says otherwise
+            self._total_result = len(self._result)
+        return records
 
+    def request_next(self):
+        result = self._request(self._next_offset)
         self._next_offset += self._limit
-        return result[self._source_name]
+        return self._add_result(result)
+
+    def request_remaining(self):
+        """
+        Request all pages left at once. Yield records of every page as soon as its predecessors are done.
+        """
+        offsets = list(range(self._next_offset, self._total_result, self._limit))
+
+        for result in run_parallel(self._request, offsets, jobs=min(self._workers, len(offsets))):
+            self._next_offset += self._limit
+            for res in self._add_result(result):
+                yield res
 
     def has_next(self):
         return self._total_result is None or len(self._result) < self._total_result
@@ -105,7 +147,10 @@ class ResponsePaginatedResult(object):
             yield res
 
         while self.has_next():
-            next_result = self.request_next()
+            if self._workers > 1 and self._total_result is not None and self._next_offset < self._total_result:
+                next_result = self.request_remaining()
+            else:
+                next_result = self.request_next()
             for res in next_result:
                 yield res
 
@@ -126,10 +171,16 @@ class ResponsePaginatedResult(object):
 
 
 def paginated(source_name):
+    """
+    Turn API method into ResponsePaginatedResult. Page size and number of concurrent page requests
+    are taken from `page_size` and `pagination_workers` of the API object.
+    """
     def wrapper(func):
         @functools.wraps(func)
-        def _wrap(*args, **kwargs):
-            return ResponsePaginatedResult(source_name, func, args, kwargs)
+        def _wrap(self, *args, **kwargs):
+            kwargs.setdefault('limit', self.page_size)
+            return ResponsePaginatedResult(source_name, func, (self, ) + args, kwargs,
+                                           workers=self.pagination_workers)
 
         return _wrap
 
@@ -156,26 +207,142 @@ def _debug_response(resp):
         log.debug('Request debug was disabled because of unsupported terminal encoding')
 
 
+class PooledHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter which reports how often pooled connections were reused.
+    """
+
+    def stats(self):
+        """
+        :return: dict with `requests`, `hits` (reused connections) and `misses` (new connections)
+        """
+        requests_count = 0
+        connections_count = 0
+        pools = self.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            requests_count += pool.num_requests
+            connections_count += pool.num_connections
+
+        return {
+            'requests': requests_count,
+            'hits': max(requests_count - connections_count, 0),
+            'misses': connections_count,
+        }
+
+
+_SESSION = None
+
+
+def create_session(http_settings):
+    session = requests.Session()
+    adapter = PooledHTTPAdapter(pool_connections=http_settings['pool_connections'],
+                                pool_maxsize=http_settings['pool_maxsize'],
+                                pool_block=http_settings['pool_block'])
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    if not http_settings['keep_alive']:
+        session.headers['Connection'] = 'close'
+
+    return session
+
+
+def get_session(config):
+    """
+    Return the process wide session. It is created on first use from the `http` settings of the config.
+    """
+    global _SESSION
+    if _SESSION is None:
+        _SESSION = create_session(get_http_settings(config))
+    return _SESSION
+
+
+def session_stats(session=None):
+    """
+    Sum connection pool counters over all adapters mounted to the session.
+    :return: dict with `requests`, `hits` and `misses` or None if no session was created yet
+    """
+    session = session or _SESSION
+    if session is None:
+        return None
+
+    stats = {'requests': 0, 'hits': 0, 'misses': 0}
+    for adapter in set(session.adapters.values()):
+        if not isinstance(adapter, PooledHTTPAdapter):
+            continue
+        for key, value in adapter.stats().items():
+            stats[key] += value
+
+    return stats
+
+
+_SCHEDULER = None
+
+
+def create_scheduler(http_settings):
+    return RequestScheduler(retries=http_settings['retries'],
+                            backoff=http_settings['backoff'],
+                            max_backoff=http_settings['max_backoff'],
+                            rate_limit=http_settings['rate_limit'],
+                            burst=http_settings['burst'])
+
+
+def get_scheduler(config):
+    """
+    Return the process wide request scheduler, so all threads share one rate limit.
+    """
+    global _SCHEDULER
+    if _SCHEDULER is None:
+        _SCHEDULER = create_scheduler(get_http_settings(config))
+    return _SCHEDULER
+
+
+_CONDITIONAL_STATS = {'requests': 0, 'not_modified': 0, 'bytes_saved': 0}
+_CONDITIONAL_STATS_LOCK = threading.Lock()
+
+
+def _count_conditional(not_modified=False, bytes_saved=0):
+    with _CONDITIONAL_STATS_LOCK:
+        _CONDITIONAL_STATS['requests'] += 1
+        if not_modified:
+            _CONDITIONAL_STATS['not_modified'] += 1
+            _CONDITIONAL_STATS['bytes_saved'] += bytes_saved
+
+
+def conditional_stats():
+    """
+    :return: dict with number of conditional `requests`, how many were `not_modified` and the `bytes_saved`
+    """
+    with _CONDITIONAL_STATS_LOCK:
+        return dict(_CONDITIONAL_STATS)
+
+
 class ProjectAPI(object):
-    def __init__(self, config):
+    def __init__(self, config, session=None, scheduler=None):
         self._config = config
+        self._session = session or get_session(config)
+        self._scheduler = scheduler or get_scheduler(config)
 
-    def do_post(self, url, files=None, json=None, data=None, headers=None, **kwargs):
-        headers = self.build_headers(custom_headers=headers)
+        http_settings = get_http_settings(config)
+        self.page_size = http_settings['page_size']
+        self.pagination_workers = http_settings['pagination_workers']
 
-        resp = requests.post(url, files=files, json=json, data=data, headers=headers, **kwargs)
-        _debug_response(resp)
-        try:
-            resp.raise_for_status()
-        except requests.HTTPError:
-            raise exception_from_response(resp)
-        else:
-            return resp
+        cache_settings = get_cache_settings(config)
+        self._cache = ResponseCache(path=cache_settings['path'] or DEFAULT_CACHE_DIR,
+                                    ttl=cache_settings['ttl'],
+                                    enabled=cache_settings['enabled'])
+        self._refresh_cache = bool(config.get('refresh_cache'))
 
-    def do_put(self, url, files=None, json=None, data=None, headers=None, **kwargs):
+    def pool_stats(self):
+        return session_stats(self._session)
+
+    def _send(self, method, url, headers=None, **kwargs):
         headers = self.build_headers(custom_headers=headers)
 
-        resp = requests.put(url, files=files, json=json, data=data, headers=headers, **kwargs)
+        resp = self._scheduler.send(self._session, method, url, headers=headers, **kwargs)
         _debug_response(resp)
         try:
             resp.raise_for_status()
@@ -184,29 +351,71 @@ class ProjectAPI(object):
         else:
             return resp
 
-    def do_get(self, url, headers=None, **kwargs):
-        headers = self.build_headers(custom_headers=headers)
+    def do_post(self, url, files=None, json=None, data=None, headers=None, **kwargs):
+        return self._send('POST', url, files=files, json=json, data=data, headers=headers, **kwargs)
 
-        resp = requests.get(url, headers=headers, **kwargs)
-        _debug_response(resp)
-        try:
-            resp.raise_for_status()
-        except requests.HTTPError:
-            raise exception_from_response(resp)
-        else:
-            return resp
+    def do_put(self, url, files=None, json=None, data=None, headers=None, **kwargs):
+        return self._send('PUT', url, files=files, json=json, data=data, headers=headers, **kwargs)
+
+    def do_get(self, url, headers=None, **kwargs):
+        return self._send('GET', url, headers=headers, **kwargs)
 
     def do_delete(self, url, headers=None, json=None, **kwargs):
-        headers = self.build_headers(custom_headers=headers)
+        return self._send('DELETE', url, json=json, headers=headers, **kwargs)
 
-        resp = requests.delete(url, json=json, headers=headers, **kwargs)
-        _debug_response(resp)
-        try:
-            resp.raise_for_status()
-        except requests.HTTPError:
-            raise exception_from_response(resp)
-        else:
-            return resp
+    def _cache_key(self, method, url, body=None):
+        # responses can depend on the user, so the token is a part of the key
+        return make_key(self._config['access_token'], method, url, json.dumps(body, sort_keys=True))
+
+    def get_cached_json(self, url):
+        """
+        GET JSON from url, served from the response cache while it is fresh.
+        Use for rarely changing metadata only. `refresh_cache` config option forces a new request.
+        """
+        key = self._cache_key('GET', url)
+        if not self._refresh_cache:
+            entry = self._cache.load(key)
+            if self._cache.is_fresh(entry):
+                log.debug('Response for {} served from cache'.format(url))
+                return entry['body']
+
+        return self.get_conditional_json(url, always_store=True)
+
+    def get_conditional_json(self, url, always_store=False):
+        """
+        GET JSON with the validators (ETag, Last-Modified) of the cached response.
+        If the server answers 304 Not Modified, the cached body is returned.
+        Responses are cached only if they have validators, unless `always_store` is set.
+        GET only: for other methods a server answers a failed precondition with 412, not 304.
+        """
+        key = self._cache_key('GET', url)
+        entry = self._cache.load(key)
+
+        headers = {}
+        validators = entry['validators'] if entry else {}
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+
+        resp = self.do_get(url, headers=headers)
+
+        if resp.status_code == 304 and entry:
+            log.debug('Response for {} not modified'.format(url))
+            _count_conditional(not_modified=True, bytes_saved=entry.get('size') or 0)
+            self._cache.store(key, entry['body'], validators=validators, size=entry.get('size'))
+            return entry['body']
+
+        data = resp.json()
+        validators = {
+            'etag': resp.headers.get('ETag'),
+            'last_modified': resp.headers.get('Last-Modified'),
+        }
+        if headers:
+            _count_conditional()
+        if always_store or any(validators.values()):
+            self._cache.store(key, data, validators=validators, size=len(resp.content))
+        return data
 
     def build_headers(self, custom_headers=None):
         default_headers = {
@@ -227,9 +436,7 @@ class ProjectAPI(object):
         )
         language_url = self.build_url(*params)
 
-        resp = self.do_get(language_url)
-
-        return resp.json()['languages']
+        return self.get_cached_json(language_url)['languages']
 
 
     def get_milestone(self, language_id, user_id):
@@ -256,9 +463,7 @@ class ProjectAPI(object):
             str(self._config['project_id'])
         )
 
-        resp = self.do_get(self.build_url(*params))
-
-        return resp.json()['project']
+        return self.get_cached_json(self.build_url(*params))['project']
 
     @paginated('projects')
 
@@ -501,7 +706,22 @@ class ProjectAPI(object):
         :param source_columns:
         :param reference_columns:
         :param str version_tag:
-        :param bool force:
+        :return:
+        """
+        return self.append_files([{
+            'upload_id': upload_id,
+            'file_name': file_name,
+            'source_columns': source_columns,
+            'reference_columns': reference_columns,
+            'version_tag': version_tag,
+        }, ])
+
+    def append_files(self, files):
+        """
+        Attach several uploaded files to qordoba project with one request.
+
+        :param list files: dicts with `upload_id`, `file_name` and optional `source_columns`,
+            `reference_columns` and `version_tag` keys. See `append_file`.
         :return:
         """
         params = (
@@ -512,19 +732,22 @@ class ProjectAPI(object):
 
         query = {}
 
-        payload = {
-            'id': upload_id,
-            'file_name': file_name,
-            'source_columns': source_columns or []
-        }
-        if reference_columns is not None:
-            payload['reference_columns'] = reference_columns
-        if version_tag is not None:
-            payload['version_tag'] = version_tag
+        payload = []
+        for item in files:
+            file_payload = {
+                'id': item['upload_id'],
+                'file_name': item['file_name'],
+                'source_columns': item.get('source_columns') or []
+            }
+            if item.get('reference_columns') is not None:
+                file_payload['reference_columns'] = item['reference_columns']
+            if item.get('version_tag') is not None:
+                file_payload['version_tag'] = item['version_tag']
+            payload.append(file_payload)
 
         upload_url = self.build_url(*params, **query)
 
-        resp = self.do_post(upload_url, json=[payload, ])
+        resp = self.do_post(upload_url, json=payload)
         log.debug('Response body: {}'.format(resp.json()))
         return resp.json()
 
@@ -544,6 +767,18 @@ class ProjectAPI(object):
         return self.do_get(download_url, stream=True)
 
 
+    def resume_download(self, url, offset):
+        """
+        Continue download of the raw file URL (`download_file(...).url`) from `offset` bytes.
+        Content is requested without compression, so offset matches the bytes already written.
+        :return: Streamed response. Status 206 if the server continues from offset, 200 if it sends the whole file.
+        """
+        headers = {
+            'Range': 'bytes={}-'.format(offset),
+            'Accept-Encoding': 'identity',
+        }
+        return self.do_get(url, headers=headers, stream=True)
+
     def download_file(self, page_id, language_id, milestone=None):
         if milestone is None:
             milestone = DEFAULT_MILESTONE_ID
@@ -581,6 +816,26 @@ class ProjectAPI(object):
 
         return self.build_url(*params, **query)
 
+    def stream_file(self, url, fileobj, chunk_size=DOWNLOAD_CHUNK_SIZE):
+        """
+        Write content of a download URL (e.g. from `download_files`) to `fileobj` chunk by chunk.
+        The URL is signed, so the auth headers are not sent.
+        :return: number of bytes written
+        """
+        resp = self._scheduler.send(self._session, 'GET', url, stream=True)
+        _debug_response(resp)
+        try:
+            resp.raise_for_status()
+        except requests.HTTPError:
+            raise exception_from_response(resp)
+
+        size = 0
+        for chunk in resp.iter_content(chunk_size=chunk_size):
+            fileobj.write(chunk)
+            size += len(chunk)
+
+        return size
+
     def download_files(self, page_ids, languages, milestone=None):
         """
         Download archive with translation for selected languages.
@@ -652,8 +907,11 @@ class ProjectAPI(object):
 
         pages_url = self.build_url(*params, **query)
 
-        resp = self.do_get(pages_url)
-        return resp.json()
+        if offset:
+            # only the first page of a listing is cached, so the cache doesn't grow with every offset
+            resp = self.do_get(pages_url)
+            return resp.json()
+        return self.get_conditional_json(pages_url)
 
     def get_page_stats(self, language_id, page_id):
         """
@@ -885,8 +1143,7 @@ class ProjectAPI(object):
 
         progress_url = self.build_url(*params, **query)
 
-        resp = self.do_get(progress_url)
-        return resp.json()
+        return self.get_conditional_json(progress_url)
 
     @paginated('pages')
     def page_search(self, language_id, status=None, limit=50, offset=0, search_string=None):
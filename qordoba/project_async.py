@@ -0,0 +1,433 @@
+"""
+asyncio client of the Qordoba API. Requires python 3.6+ and aiohttp:
+
+    async with AsyncProjectAPI(config) as api:
+        async for page in api.page_search(language_id):
+            ...
+"""
+import asyncio
+import functools
+import json
+import logging
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from qordoba import project
+from qordoba.project import DEFAULT_MILESTONE_ID, DOWNLOAD_CHUNK_SIZE, exception_from_content, create_scheduler
+from qordoba.scheduler import RETRY_STATUSES, parse_retry_after
+from qordoba.settings import get_http_settings
+from qordoba.utils import build_url
+
+log = logging.getLogger('qordoba')
+
+
+class AsyncResponsePaginatedResult(object):
+    """
+    Async counterpart of `ResponsePaginatedResult`.
+
+    The first page tells the total number of results, then up to `workers` of the remaining
+    pages are requested at once. Records are yielded in the server order.
+    """
+
+    def __init__(self, source_name, func, args, kwargs, workers=1):
+        self._source_name = source_name
+        self._func = func
+        self._args = args
+        self._kwargs = kwargs
+        self._limit = kwargs.get('limit', 50)
+        self._next_offset = 0
+        self._workers = max(workers, 1)
+
+        self._total_result = None
+        self._result = []
+
+    def _request(self, offset):
+        kwargs = dict(self._kwargs, offset=offset)
+        return self._func(*self._args, **kwargs)
+
+    def _add_result(self, result):
+        records = result[self._source_name]
+        self._result.extend(records)
+        self._total_result = result['meta']['paging']['total_results']
+        if not records:
+            # nothing more to fetch, even if total_results says otherwise
+            self._total_result = len(self._result)
+        self._next_offset += self._limit
+        return records
+
+    def has_next(self):
+        return self._total_result is None or len(self._result) < self._total_result
+
+    def __len__(self):
+        return self._total_result
+
+    async def __aiter__(self):
+        for res in list(self._result):
+            yield res
+
+        while self.has_next():
+            if self._total_result is None:
+                offsets = [self._next_offset]
+            else:
+                offsets = list(range(self._next_offset, self._total_result, self._limit))[:self._workers]
+
+            results = await asyncio.gather(*[self._request(offset) for offset in offsets])
+            for result in results:
+                for res in self._add_result(result):
+                    yield res
+                if not self.has_next():
+                    break
+
+    async def filter_by(self, func):
+        async for res in self:
+            if func(res):
+                yield res
+
+    async def get_one(self):
+        return await self.__aiter__().__anext__()
+
+    async def get(self, limit):
+        if limit <= 0:
+            return
+        count = 0
+        async for res in self:
+            yield res
+            count += 1
+            if count >= limit:
+                break
+
+    async def all(self):
+        return [res async for res in self]
+
+
+def async_paginated(source_name):
+    """
+    Turn async API method into AsyncResponsePaginatedResult. See `qordoba.project.paginated`.
+    """
+    def wrapper(func):
+        @functools.wraps(func)
+        def _wrap(self, *args, **kwargs):
+            kwargs.setdefault('limit', self.page_size)
+            return AsyncResponsePaginatedResult(source_name, func, (self, ) + args, kwargs,
+                                                workers=self.pagination_workers)
+
+        return _wrap
+
+    return wrapper
+
+
+class AsyncResponse(object):
+    """
+    Status, headers and body of a finished request.
+    """
+
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content.decode('utf-8'))
+
+
+class AsyncProjectAPI(object):
+    """
+    Same API methods as `qordoba.project.ProjectAPI`, as coroutines. Requests share the
+    retry policy and the rate limit settings of the `http` config key. Responses are not cached.
+    """
+
+    def __init__(self, config, session=None, scheduler=None):
+        if aiohttp is None:
+            raise ImportError('AsyncProjectAPI requires aiohttp. Install it with `pip install aiohttp`')
+
+        self._config = config
+        self._session = session
+        self._own_session = session is None
+
+        http_settings = get_http_settings(config)
+        self._http_settings = http_settings
+        self.page_size = http_settings['page_size']
+        self.pagination_workers = http_settings['pagination_workers']
+        self._scheduler = scheduler or create_scheduler(http_settings)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    @property
+    def session(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit_per_host=self._http_settings['pool_maxsize'],
+                                             force_close=not self._http_settings['keep_alive'])
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self):
+        if self._own_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _acquire(self):
+        bucket = self._scheduler.bucket
+        if bucket is None:
+            return
+        wait = bucket.reserve()
+        while wait:
+            await asyncio.sleep(wait)
+            wait = bucket.reserve()
+
+    async def _request(self, method, url, headers=None, chunk_handler=None, **kwargs):
+        """
+        Send request with retries. `data` may be a callable returning a fresh payload
+        for every attempt, e.g. multipart forms which can be sent only once.
+        :param chunk_handler: Called with every chunk of the body instead of reading it into memory.
+            Once it got a chunk the request is not retried, as the handler can't take the body again
+        :rtype: AsyncResponse
+        """
+        data = kwargs.pop('data', None)
+        attempt = 0
+        streamed = False
+        while True:
+            await self._acquire()
+            if callable(data):
+                kwargs['data'] = data()
+            elif data is not None:
+                kwargs['data'] = data
+
+            try:
+                async with self.session.request(method, url, headers=headers, **kwargs) as resp:
+                    status = resp.status
+                    if status in RETRY_STATUSES and self._scheduler.can_retry(method, attempt, status):
+                        retry_after = parse_retry_after(resp.headers.get('Retry-After'))
+                        reason = '{} {}'.format(status, resp.reason)
+                    elif status < 400 and chunk_handler is not None:
+                        async for chunk in resp.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                            streamed = True
+                            chunk_handler(chunk)
+                        return AsyncResponse(status, resp.headers, b'')
+                    else:
+                        content = await resp.read()
+                        log.debug('Response({}): status_code: {}'.format(url, status))
+                        if status >= 400:
+                            raise exception_from_content(content, method, url)
+                        return AsyncResponse(status, resp.headers, content)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if streamed or not self._scheduler.can_retry(method, attempt):
+                    raise
+                status = None
+                retry_after = None
+                reason = str(e)
+
+            delay = self._scheduler.get_backoff(attempt) if retry_after is None else retry_after
+            if status == 429 and self._scheduler.bucket is not None:
+                self._scheduler.bucket.pause(delay)
+            attempt += 1
+            log.debug('{} {} failed ({}). Retry {}/{} in {:.1f}s'.format(method, url, reason, attempt,
+                                                                        self._scheduler.retries, delay))
+            await asyncio.sleep(delay)
+
+    def build_headers(self, custom_headers=None):
+        headers = {
+            'X-AUTH-TOKEN': self._config['access_token'],
+        }
+        if custom_headers:
+            headers.update(custom_headers)
+        return headers
+
+    def build_url(self, *args, **kwargs):
+        return build_url(project.API_URL, *args, **kwargs)
+
+    async def do_get(self, url, headers=None, **kwargs):
+        return await self._request('GET', url, headers=self.build_headers(headers), **kwargs)
+
+    async def do_post(self, url, json=None, data=None, headers=None, **kwargs):
+        return await self._request('POST', url, json=json, data=data, headers=self.build_headers(headers), **kwargs)
+
+    async def do_put(self, url, json=None, data=None, headers=None, **kwargs):
+        return await self._request('PUT', url, json=json, data=data, headers=self.build_headers(headers), **kwargs)
+
+    async def do_delete(self, url, json=None, headers=None, **kwargs):
+        return await self._request('DELETE', url, json=json, headers=self.build_headers(headers), **kwargs)
+
+    @staticmethod
+    def _file_form(stream, file_name, mimetype, **fields):
+        def build():
+            if hasattr(stream, 'seek'):
+                stream.seek(0)
+            form = aiohttp.FormData()
+            for name, value in fields.items():
+                form.add_field(name, value)
+            form.add_field('file', stream, filename=str(file_name), content_type=mimetype)
+            return form
+
+        return build
+
+    def _project_params(self, *params):
+        return ('projects', str(self._config['project_id'])) + params
+
+    async def get_languages(self):
+        resp = await self.do_get(self.build_url('languages'))
+        return resp.json()['languages']
+
+    async def get_project(self):
+        resp = await self.do_get(self.build_url(*self._project_params()))
+        return resp.json()['project']
+
+    async def get_milestone(self, language_id, user_id):
+        params = self._project_params('languages', str(language_id), 'users', str(user_id), 'milestones')
+        resp = await self.do_get(self.build_url(*params))
+        return resp.json()['milestones']
+
+    @async_paginated('projects')
+    async def get_projects(self, limit=50, offset=0):
+        params = ('organizations', str(self._config['organization_id']), 'projects')
+        resp = await self.do_get(self.build_url(*params, limit=limit, offset=offset))
+        return resp.json()
+
+    async def upload_anytype_file(self, stream, file_name, content_type_code,
+                                  mimetype='application/octet-stream', force=False, **kwargs):
+        """
+        See `ProjectAPI.upload_anytype_file`
+        """
+        params = ('organizations', str(self._config['organization_id']), 'upload', 'uploadFile_anyType')
+        query = {
+            'projectId': self._config['project_id'],
+            'content_type_code': content_type_code
+        }
+
+        resp = await self.do_post(self.build_url(*params, **query),
+                                  data=self._file_form(stream, file_name, mimetype, file_names=json.dumps([])))
+        return resp.json()
+
+    async def update_upload_anyType_file(self, stream, file_name, file_id, mimetype='application/octet-stream'):
+        params = self._project_params('files', str(file_id), 'update', 'upload')
+        resp = await self.do_post(self.build_url(*params), data=self._file_form(stream, file_name, mimetype))
+        return resp.json()
+
+    async def apply_upload_file(self, upload_id, file_id):
+        params = self._project_params('files', str(file_id), 'update', 'apply')
+        resp = await self.do_put(self.build_url(*params), json={'new_file_id': upload_id})
+        return resp.json()
+
+    async def append_file(self, upload_id, file_name, source_columns=None, reference_columns=None, version_tag=None):
+        return await self.append_files([{
+            'upload_id': upload_id,
+            'file_name': file_name,
+            'source_columns': source_columns,
+            'reference_columns': reference_columns,
+            'version_tag': version_tag,
+        }, ])
+
+    async def append_files(self, files):
+        """
+        See `ProjectAPI.append_files`
+        """
+        payload = []
+        for item in files:
+            file_payload = {
+                'id': item['upload_id'],
+                'file_name': item['file_name'],
+                'source_columns': item.get('source_columns') or []
+            }
+            if item.get('reference_columns') is not None:
+                file_payload['reference_columns'] = item['reference_columns']
+            if item.get('version_tag') is not None:
+                file_payload['version_tag'] = item['version_tag']
+            payload.append(file_payload)
+
+        resp = await self.do_post(self.build_url(*self._project_params('append_files')), json=payload)
+        return resp.json()
+
+    async def download_file(self, page_id, language_id, milestone=None, fileobj=None):
+        """
+        Export the page translation and download it.
+        :param fileobj: Write content to this file chunk by chunk instead of returning it
+        :return: Content of the file or None if `fileobj` is given
+        """
+        if milestone is None:
+            milestone = DEFAULT_MILESTONE_ID
+
+        params = self._project_params('languages', str(language_id), 'pages', str(page_id),
+                                      'segments', 'milestones', str(milestone), 'export')
+        resp = await self.do_get(self.build_url(*params))
+        data = resp.json()
+
+        download_url = self.build_url('file', 'download', token=data['token'], filename=data['filename'])
+        if fileobj is None:
+            return (await self.do_get(download_url)).content
+
+        await self.do_get(download_url, chunk_handler=fileobj.write)
+
+    async def download_files(self, page_ids, languages, milestone=None):
+        """
+        See `ProjectAPI.download_files`
+        :return: URL of the archive
+        """
+        payload = {
+            'bilingual': False,
+            'language_ids': languages,
+            'page_ids': page_ids
+        }
+        resp = await self.do_post(self.build_url(*self._project_params('export_files_bulk')), json=payload)
+        data = resp.json()
+        return self.build_url('file', 'download', token=data['token'], filename=data['filename'])
+
+    async def stream_file(self, url, fileobj):
+        """
+        Write content of a signed download URL to `fileobj` chunk by chunk.
+        :return: number of bytes written
+        """
+        written = []
+
+        def write(chunk):
+            fileobj.write(chunk)
+            written.append(len(chunk))
+
+        await self._request('GET', url, chunk_handler=write)
+        return sum(written)
+
+    @async_paginated('files')
+    async def get_pages(self, language_id, limit=50, offset=0):
+        params = self._project_params('languages', str(language_id), 'files')
+        resp = await self.do_get(self.build_url(*params, limit=limit, offset=offset))
+        return resp.json()
+
+    async def get_page_stats(self, language_id, page_id):
+        params = self._project_params('languages', str(language_id), 'files', str(page_id), 'stats')
+        resp = await self.do_get(self.build_url(*params))
+        return resp.json()
+
+    async def get_page_details(self, language_id, page_id):
+        params = self._project_params('languages', str(language_id), 'pages', str(page_id))
+        resp = await self.do_get(self.build_url(*params))
+        return resp.json()['page']
+
+    async def get_report_progress(self, language_id=None):
+        query = {}
+        if language_id:
+            query['language_id'] = language_id
+
+        resp = await self.do_get(self.build_url(*self._project_params('reports', 'progress'), **query))
+        return resp.json()
+
+    @async_paginated('pages')
+    async def page_search(self, language_id, status=None, limit=50, offset=0, search_string=None):
+        params = self._project_params('languages', str(language_id), 'page_settings', 'search')
+        body = {}
+        if status:
+            body['status'] = status
+        if search_string:
+            body['title'] = search_string
+
+        resp = await self.do_post(self.build_url(*params, limit=limit, offset=offset), json=body)
+        return resp.json()
+
+    async def delete_page(self, page_id):
+        params = ('organizations', str(self._config['organization_id'])) + self._project_params('pages', str(page_id))
+        resp = await self.do_delete(self.build_url(*params))
+        return resp.json()
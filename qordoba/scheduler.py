@@ -0,0 +1,150 @@
+from __future__ import unicode_literals, print_function
+
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_tz, mktime_tz
+
+import requests
+
+log = logging.getLogger('qordoba')
+
+RETRY_STATUSES = (429, 502, 503, 504)
+
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+
+
+def parse_retry_after(value, now=None):
+    """
+    :param str value: Retry-After header. Either seconds or HTTP date
+    :return: seconds to wait or None
+    """
+    if not value:
+        return None
+
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+
+    parsed = parsedate_tz(value)
+    if parsed is None:
+        return None
+
+    now = time.time() if now is None else now
+    return max(mktime_tz(parsed) - now, 0)
+
+
+class TokenBucket(object):
+    """
+    Thread safe token bucket. Allows `rate` requests per second with bursts of `burst` requests.
+    """
+
+    def __init__(self, rate, burst=None, clock=time.time, sleep=time.sleep):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(rate, 1))
+        self._tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._paused_until = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        if now > self._updated:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+    def reserve(self):
+        """
+        Take a token if there is one.
+        :return: 0 if the token was taken, otherwise seconds to wait before trying again
+        """
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            if now < self._paused_until:
+                return self._paused_until - now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        wait = self.reserve()
+        while wait:
+            self._sleep(wait)
+            wait = self.reserve()
+
+    def pause(self, seconds):
+        """
+        Hold all requests for `seconds`, e.g. when the server asked to slow down.
+        No tokens are collected during the pause.
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, self._clock() + seconds)
+            self._updated = max(self._updated, self._paused_until)
+            self._tokens = 0
+
+
+class RequestScheduler(object):
+    """
+    Send requests through the rate limit and retry them when the server or the connection fails.
+
+    Idempotent requests are retried on connection errors and on 429, 502, 503 and 504 responses
+    with jittered exponential backoff. Other requests are retried on 429 only, as the server
+    didn't process them. Retry-After of the response is respected and, for 429, pauses all requests.
+    """
+
+    def __init__(self, retries=3, backoff=0.5, max_backoff=30, rate_limit=None, burst=None, sleep=time.sleep):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._sleep = sleep
+        self.bucket = TokenBucket(rate_limit, burst=burst, sleep=sleep) if rate_limit else None
+
+    def can_retry(self, method, attempt, status_code=None):
+        if attempt >= self.retries:
+            return False
+        return method.upper() in IDEMPOTENT_METHODS or status_code == 429
+
+    def get_backoff(self, attempt):
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    @staticmethod
+    def _rewind(files):
+        for value in (files or {}).values():
+            stream = value[1] if isinstance(value, (tuple, list)) else value
+            if hasattr(stream, 'seek'):
+                stream.seek(0)
+
+    def send(self, session, method, url, **kwargs):
+        attempt = 0
+        while True:
+            if self.bucket is not None:
+                self.bucket.acquire()
+
+            try:
+                resp = session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if not self.can_retry(method, attempt):
+                    raise
+                delay = self.get_backoff(attempt)
+                reason = str(e)
+            else:
+                if resp.status_code not in RETRY_STATUSES or not self.can_retry(method, attempt, resp.status_code):
+                    return resp
+
+                retry_after = parse_retry_after(resp.headers.get('Retry-After'))
+                delay = self.get_backoff(attempt) if retry_after is None else retry_after
+                if resp.status_code == 429 and self.bucket is not None:
+                    self.bucket.pause(delay)
+                reason = '{} {}'.format(resp.status_code, resp.reason)
+                resp.close()
+
+            attempt += 1
+            log.debug('{} {} failed ({}). Retry {}/{} in {:.1f}s'.format(method, url, reason, attempt, self.retries,
+                                                                        delay))
+            self._sleep(delay)
+            self._rewind(kwargs.get('files'))
@@ -16,6 +16,27 @@ SETTING_PATHS = (
 )
 
 
+DEFAULT_HTTP_SETTINGS = {
+    'pool_connections': 10,
+    'pool_maxsize': 10,
+    'pool_block': False,
+    'keep_alive': True,
+    'page_size': 50,
+    'pagination_workers': 4,
+    'retries': 3,
+    'backoff': 0.5,
+    'max_backoff': 30,
+    'rate_limit': None,
+    'burst': None,
+}
+
+DEFAULT_CACHE_SETTINGS = {
+    'enabled': True,
+    'ttl': 3600,
+    'path': None,
+}
+
+
 class SettingsError(Exception):
     """
     Settings error
@@ -145,4 +166,28 @@ def get_project_file_formats(config, default=None):
     try:
         return config['file_formats']
     except (KeyError, IndexError):
-        return None
\ No newline at end of file
+        return None
+
+
+def get_http_settings(config):
+    """
+    HTTP client settings from the `http` key of .qordoba.yml merged over the defaults.
+    """
+    settings = dict(DEFAULT_HTTP_SETTINGS)
+    try:
+        settings.update(config['http'] or {})
+    except (KeyError, TypeError):
+        pass
+    return settings
+
+
+def get_cache_settings(config):
+    """
+    Response cache settings from the `cache` key of .qordoba.yml merged over the defaults.
+    """
+    settings = dict(DEFAULT_CACHE_SETTINGS)
+    try:
+        settings.update(config['cache'] or {})
+    except (KeyError, TypeError):
+        pass
+    return settings
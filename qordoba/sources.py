@@ -1,11 +1,19 @@
 from __future__ import unicode_literals, print_function
 
+import fnmatch
 import glob
+import itertools
 import logging
 import os
 import re
 from collections import OrderedDict
 
+try:
+    from os import scandir
+except ImportError:
+    # python27
+    from scandir import scandir
+
 from qordoba.languages import normalize_language, LanguageNotFound
 from qordoba.utils import python_2_unicode_compatible
 
@@ -13,7 +21,8 @@ log = logging.getLogger('qordoba')
 
 DEFAULT_PATTERN = '<language_code>.<extension>'
 
-CONTENT_TYPE_CODES = dict()
+# order matters: the first content type of an extension is its default
+CONTENT_TYPE_CODES = OrderedDict()
 CONTENT_TYPE_CODES['excel'] = ('xlsx',)
 CONTENT_TYPE_CODES['xliff'] = ('xliff', 'xlf')
 CONTENT_TYPE_CODES['XLIFF1.2'] = ('xliff', 'xlf')
@@ -40,6 +49,16 @@ ALLOWED_EXTENSIONS = dict(
     {extension: k for k, extensions in CONTENT_TYPE_CODES.items() for extension in extensions}
 )
 
+# third party and build folders which never contain project sources
+VENDORED_DIRS = frozenset((
+    'node_modules',
+    'bower_components',
+    'jspm_packages',
+    'Pods',
+    'Carthage',
+    '__pycache__',
+))
+
 ADJUST_EXTENSION = {
     # "resx": "regex",
 }
@@ -193,104 +212,359 @@ def language_code_country_capitalize(language):
     return language_code_country_capitalized
 
 
+def _filename_variables(source_name, version_tag=None):
+    try:
+        filename, extension = os.path.splitext(source_name)
+        extension = extension.strip('.')
+        if version_tag:
+            filename = version_tag + '_' + filename
+    except (ValueError, AttributeError):
+        extension = ''
+        filename = source_name
+        if version_tag:
+            filename = version_tag + '_' + filename
+
+    return {
+        PatternVariables.filename: filename,
+        PatternVariables.extension: extension,
+    }
+
+
+LANGUAGE_VARIABLES = {
+    PatternVariables.language_code: lambda language: language.code,
+    PatternVariables.language_lang_code: lambda language: language.lang,
+    PatternVariables.language_code_country_capitalized: language_code_country_capitalize,
+    PatternVariables.local_capitalized: lambda language: local_capitalize(language.code),
+    PatternVariables.language_name: lambda language: language.name,
+    PatternVariables.language_name_cap: lambda language: language.name.capitalize(),
+    PatternVariables.language_name_allcap: lambda language: language.name.upper(),
+}
+
+# Apple lproj folders use custom codes for some languages
+CUSTOM_LANGUAGE_VARIABLES = {name: custom_language for name in LANGUAGE_VARIABLES}
+CUSTOM_LANGUAGE_VARIABLES.update({
+    PatternVariables.local_capitalized: LANGUAGE_VARIABLES[PatternVariables.local_capitalized],
+    PatternVariables.language_code_country_capitalized: language_code_country_capitalize,
+})
+
+
+class LanguageVariables(dict):
+    """
+    Pattern variable values of a language, computed on first use.
+    """
+
+    def __init__(self, language, getters):
+        super(LanguageVariables, self).__init__()
+        self._language = language
+        self._getters = getters
+
+    def __missing__(self, name):
+        value = self[name] = self._getters[name](self._language)
+        return value
+
+
+class PullPatternTemplate(object):
+    """
+    Pull pattern parsed once into literal and variable segments.
+    Unknown `<...>` placeholders are kept as literals.
+    """
+    placeholder_regexp = re.compile(r'<([a-z_]+)>')
+
+    _language_variables = {}
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.is_valid = bool(pull_pattern_validate_regexp.search(pattern))
+        self.lproj = 'lproj' in pattern
+
+        self.segments = []
+        position = 0
+        for match in self.placeholder_regexp.finditer(pattern):
+            name = match.group(1)
+            if name not in LANGUAGE_VARIABLES and name not in (PatternVariables.filename, PatternVariables.extension):
+                continue
+            if match.start() > position:
+                self.segments.append((False, pattern[position:match.start()]))
+            self.segments.append((True, name))
+            position = match.end()
+        if position < len(pattern):
+            self.segments.append((False, pattern[position:]))
+
+        self.variables = set(value for is_variable, value in self.segments if is_variable)
+        self.uses_filename = bool(self.variables & set((PatternVariables.filename, PatternVariables.extension)))
+
+    @classmethod
+    def get_language_variables(cls, language, custom=False):
+        key = (language.code, custom)
+        variables = cls._language_variables.get(key)
+        if variables is None:
+            variables = LanguageVariables(language, CUSTOM_LANGUAGE_VARIABLES if custom else LANGUAGE_VARIABLES)
+            cls._language_variables[key] = variables
+        return variables
+
+    def render(self, language, source_name=None, version_tag=None):
+        """
+        :param qordoba.languages.Language language:
+        :rtype: str
+        """
+        variables = self.get_language_variables(language,
+                                                custom=self.lproj and str(language) in CUSTOM_LANGUAGE_CODE)
+        file_variables = _filename_variables(source_name, version_tag=version_tag) if self.uses_filename else {}
+
+        parts = []
+        for is_variable, value in self.segments:
+            if not is_variable:
+                parts.append(value)
+            elif value in file_variables:
+                parts.append(file_variables[value])
+            else:
+                parts.append(variables[value])
+        return ''.join(parts)
+
+
+_PULL_TEMPLATES = {}
+
+
+def get_pull_template(pattern):
+    """
+    :rtype: PullPatternTemplate
+    """
+    template = _PULL_TEMPLATES.get(pattern)
+    if template is None:
+        template = _PULL_TEMPLATES[pattern] = PullPatternTemplate(pattern)
+    return template
+
+
 def create_target_path_by_pattern(curdir, language, version_tag, source_name,  pattern=None, distinct=False, content_type_code=None):
 
-    if not distinct and pattern is not None and not pull_pattern_validate_regexp.search(pattern):
+    if pattern is None:
+        target_path = language.code + '-' + source_name
+        if version_tag:
+            target_path = language.code + '-' + version_tag + '_' + source_name
+        return validate_path(curdir, target_path, language)
+
+    if not distinct and not get_pull_template(pattern).is_valid:
         raise PatternNotValid(
             'Pull pattern is not valid. Pattern should contain one of the values: {}'.format(
                 ', '.join(PatternVariables.all)))
 
-    if pattern is None:
-        pattern = language.code + '-' + source_name
-        if version_tag:
-            pattern = language.code + '-' + version_tag + '_' + source_name
-
-    pattern = pattern or DEFAULT_PATTERN
-
-    if 'lproj' in pattern and str(language) in CUSTOM_LANGUAGE_CODE.keys():
-        target_path = pattern.replace('<{}>'.format(PatternVariables.language_code), custom_language(language))
-        target_path = target_path.replace('<{}>'.format(PatternVariables.local_capitalized), local_capitalize(language.code))
-        target_path = target_path.replace('<{}>'.format(PatternVariables.language_code_country_capitalized), language_code_country_capitalize(language))
-        target_path = target_path.replace('<{}>'.format(PatternVariables.language_lang_code), custom_language(language))
-        target_path = target_path.replace('<{}>'.format(PatternVariables.language_name), custom_language(language))
-        target_path = target_path.replace('<{}>'.format(PatternVariables.language_name_cap),
-                                          custom_language(language))
-        target_path = target_path.replace('<{}>'.format(PatternVariables.language_name_allcap),
-                                          custom_language(language))
-
-    else:
-        target_path = pattern.replace('<{}>'.format(PatternVariables.language_code), language.code)
-        target_path = target_path.replace('<{}>'.format(PatternVariables.language_lang_code), language.lang)
-        target_path = target_path.replace('<{}>'.format(PatternVariables.language_code_country_capitalized), language_code_country_capitalize(language))
-        target_path = target_path.replace('<{}>'.format(PatternVariables.local_capitalized), local_capitalize(language.code))
-        target_path = target_path.replace('<{}>'.format(PatternVariables.language_name), language.name)
-        target_path = target_path.replace('<{}>'.format(PatternVariables.language_name_cap),
-                                          language.name.capitalize())
-        target_path = target_path.replace('<{}>'.format(PatternVariables.language_name_allcap),
-                                          language.name.upper())
-
-
-    if '<{}>'.format(PatternVariables.extension) in target_path \
-            or '<{}>'.format(PatternVariables.filename) in target_path:
-        try:
-            filename, extension = os.path.splitext(source_name)
-            extension = extension.strip('.')
-            if version_tag:
-                filename, extension = os.path.splitext(source_name)
-                filename = version_tag + '_' + filename
-                extension = extension.strip('.')
-        except (ValueError, AttributeError):
-            extension = ''
-            filename = source_name
-            if version_tag:
-                filename = version_tag + '_' + filename
-
-        target_path = target_path.replace('<{}>'.format(PatternVariables.extension), extension)
-        target_path = target_path.replace('<{}>'.format(PatternVariables.filename), filename)
-
+    template = get_pull_template(pattern or DEFAULT_PATTERN)
+    target_path = template.render(language, source_name=source_name, version_tag=version_tag)
     return validate_path(curdir, target_path, language)
 
 
-def files_in_project(curpath, return_absolute_path=True):
-    """
-    Iterate over the files in the project.
+def _dir_key(entry):
+    stat = entry.stat()
+    if not stat.st_ino:
+        # DirEntry.stat() on Windows doesn't fill inode and device
+        stat = os.stat(entry.path)
+    return stat.st_dev, stat.st_ino
 
-    Return each file under ``curpath`` with its absolute name.
+
+def walk_project(curpath, exclude_dir=None, skip_hidden=True, follow_symlinks=True):
     """
-    visited = set()
-    for root, dirs, files in os.walk(curpath, followlinks=True):
-        root_realpath = os.path.realpath(root)
+    Iterate over the files under ``curpath``, top down, with ``os.scandir``.
 
-        # Don't visit any subdirectory
-        if root_realpath in visited:
-            del dirs[:]
+    Directories are tracked by (st_dev, st_ino), so symlink cycles and directories
+    linked twice are visited once. Hidden entries and excluded directories are pruned
+    before they are entered.
+
+    :param exclude_dir: callable receiving the relative path and the name of a directory.
+        Its subtree is skipped if it returns True. By default VENDORED_DIRS are skipped
+    :return: iterator of (relative path, os.DirEntry) tuples
+    """
+    if exclude_dir is None:
+        exclude_dir = lambda relpath, name: name in VENDORED_DIRS
+
+    root_stat = os.stat(curpath)
+    visited = {(root_stat.st_dev, root_stat.st_ino)}
+    stack = [('', curpath)]
+    while stack:
+        relroot, root = stack.pop()
+        try:
+            entries = sorted(scandir(root), key=lambda e: e.name)
+        except OSError as e:
+            log.debug('Could not list directory `{}`: {}'.format(root, e))
             continue
 
-        for f in files:
-            file_path = os.path.realpath(os.path.join(root, f))
-            if not return_absolute_path:
-                file_path = os.path.relpath(file_path, curpath)
-            yield file_path
+        subdirs = []
+        for entry in entries:
+            if skip_hidden and _ishidden(entry.name):
+                continue
+
+            relpath = os.path.join(relroot, entry.name) if relroot else entry.name
+            try:
+                if entry.is_dir(follow_symlinks=follow_symlinks):
+                    if exclude_dir(relpath, entry.name):
+                        continue
+                    key = _dir_key(entry)
+                    if key not in visited:
+                        visited.add(key)
+                        subdirs.append((relpath, entry.path))
+                elif entry.is_file(follow_symlinks=follow_symlinks):
+                    yield relpath, entry
+            except OSError:
+                # broken symlink or entry removed while walking
+                continue
+
+        stack.extend(reversed(subdirs))
+
+
+def files_in_project(curpath, return_absolute_path=True, **kwargs):
+    """
+    Iterate over the files in the project. See `walk_project` for options.
 
-        visited.add(root_realpath)
+    Return each file under ``curpath`` with its absolute name.
+    """
+    root = os.path.abspath(curpath)
+    for relpath, entry in walk_project(curpath, **kwargs):
+        yield os.path.join(root, relpath) if return_absolute_path else relpath
 
-        # Find which directories are already visited and remove them from
-        # further processing
-        removals = list(
-            d for d in dirs
-            if os.path.realpath(os.path.join(root, d)) in visited
-        )
-        for removal in removals:
-            dirs.remove(removal)
 
+def translation_files_in_project(curpath, lang, **kwargs):
+    """
+    Lazily yield TranslationFile of every file in the project. See `walk_project` for options.
+    """
+    lang = normalize_language(lang)
+    for relpath, entry in walk_project(curpath, **kwargs):
+        yield TranslationFile(relpath, lang, curpath)
 
 
 def _ishidden(path):
     return path[0] in ('.', b'.'[0])
 
 
+class PushPattern(object):
+    """
+    Push pattern compiled into one matcher per path segment. Segments follow glob rules,
+    except that a trailing `/*` matches files in all subfolders too.
+    """
+    flags = re.IGNORECASE if os.name == 'nt' else 0
+
+    def __init__(self, pattern, curpath):
+        self.pattern = pattern
+        path = os.path.relpath(pattern, curpath) if os.path.isabs(pattern) else os.path.normpath(pattern)
+        parts = [part for part in to_posix(path).split('/') if part not in ('', '.')]
+
+        # decided from the raw pattern, `./*` pushes the whole project
+        self.recursive = to_posix(pattern).endswith('/*')
+        if self.recursive:
+            parts = parts[:-1]
+        self.is_external = bool(parts) and parts[0] == os.pardir
+        self.segments = [self._compile(part) for part in parts]
+
+    @classmethod
+    def _compile(cls, segment):
+        if not glob.has_magic(segment):
+            return segment
+        regexp = fnmatch.translate(segment)
+        if not segment.startswith('.'):
+            # like glob, wildcards don't match hidden names
+            regexp = r'(?!\.)' + regexp
+        return re.compile(regexp, cls.flags)
+
+    @staticmethod
+    def _match_segment(segment, name):
+        if hasattr(segment, 'match'):
+            return segment.match(name) is not None
+        return segment == name
+
+    def _match_prefix(self, parts):
+        return all(self._match_segment(segment, name) for segment, name in zip(self.segments, parts))
+
+    def may_contain(self, parts):
+        """
+        :param list parts: Folder path segments
+        :return: False if no file under the folder can match
+        """
+        if not self.recursive and len(parts) >= len(self.segments):
+            return False
+        if self.recursive and len(parts) > len(self.segments) and _ishidden(parts[-1]):
+            return False
+        return self._match_prefix(parts)
+
+    def match(self, parts):
+        """
+        :param list parts: File path segments
+        """
+        if self.recursive:
+            return len(parts) > len(self.segments) and not _ishidden(parts[-1]) and self._match_prefix(parts)
+        return len(parts) == len(self.segments) and self._match_prefix(parts)
+
+
+class PushPatternMatcher(object):
+    """
+    All push patterns evaluated in a single walk of the project. Every file is matched once,
+    even if several patterns match it. Patterns outside of the project folder are globbed.
+    """
+
+    def __init__(self, patterns, curpath, exclude_dir=None):
+        """
+        :param exclude_dir: additional folder predicate, see `walk_project`
+        """
+        self.curpath = curpath
+        self.patterns = [PushPattern(pattern, curpath) for pattern in patterns]
+        self.exclude_dir = exclude_dir
+
+    def _exclude_dir(self, relpath, name):
+        if self.exclude_dir is not None and self.exclude_dir(relpath, name):
+            return True
+        parts = to_posix(relpath).split('/')
+        return not any(pattern.may_contain(parts) for pattern in self.patterns if not pattern.is_external)
+
+    def _walk(self):
+        if not any(not pattern.is_external for pattern in self.patterns):
+            return
+
+        # hidden files match literal segments only, wildcards skip them
+        for relpath, entry in walk_project(self.curpath, exclude_dir=self._exclude_dir, skip_hidden=False):
+            parts = to_posix(relpath).split('/')
+            if any(pattern.match(parts) for pattern in self.patterns if not pattern.is_external):
+                yield relpath
+
+    def _glob(self):
+        for pattern in self.patterns:
+            if not pattern.is_external:
+                continue
+            for path in glob.iglob(os.path.join(self.curpath, pattern.pattern)):
+                if not os.path.isdir(path):
+                    yield os.path.relpath(path, self.curpath)
+
+    def find(self):
+        """
+        :return: iterator of matched file paths relative to the project folder
+        """
+        seen = set()
+        for relpath in itertools.chain(self._walk(), self._glob()):
+            key = os.path.normcase(os.path.normpath(relpath))
+            if key not in seen:
+                seen.add(key)
+                yield relpath
+
+
+def find_files_by_patterns(curpath, patterns, lang, remote_content_type_codes, exclude_dir=None):
+    """
+    Find files matching any of the push patterns with one walk of the project.
+    :param exclude_dir: folder predicate, see `walk_project`
+    :rtype: list of qordoba.sources.TranslationFile
+    """
+    content_types = get_content_type_resolver(remote_content_type_codes)
+    lang = normalize_language(lang)
+
+    for relpath in PushPatternMatcher(patterns, curpath, exclude_dir=exclude_dir).find():
+        path = TranslationFile(relpath, lang, curpath)
+        try:
+            content_types.resolve(path)
+        except FileExtensionNotAllowed as e:
+            log.info('File path ignored: {}'.format(e))
+            continue
+
+        yield path
+
+
 def find_files_by_pattern(curpath, pattern, lang, remote_content_type_codes):
     validate_push_pattern(pattern)
+    content_types = get_content_type_resolver(remote_content_type_codes)
 
     for path in glob.iglob(pattern):
         if os.path.isdir(path):
@@ -302,7 +576,7 @@ def find_files_by_pattern(curpath, pattern, lang, remote_content_type_codes):
         path = validate_path(curpath, path, lang)
 
         try:
-            _ = get_content_type_code(path, remote_content_type_codes)
+            content_types.resolve(path)
         except FileExtensionNotAllowed as e:
             log.info('File path ignored: {}'.format(e))
             continue
@@ -323,48 +597,71 @@ def add_project_file_formats(formats, target_dict=ALLOWED_EXTENSIONS):
     return target_dict
 
 
-def get_content_type_code(path, remote_content_type_codes):
+class ContentTypeResolver(object):
     """
-    :param qordoba.sources.TranslationFile path:
-    :return:
-    """
-    remote_content_types_list = list()
-    for content_type in remote_content_type_codes:
-        remote_content_types_list.append(content_type['content_type_code'])
-
-    path_ext = path.extension
+    Extension to content type code lookup, built once per project.
 
+    Extensions from `file_formats` of .qordoba.yml take precedence. Otherwise the first content type
+    of the extension enabled in the remote project is used, or the default (first) one.
+    """
 
-    if path_ext not in ALLOWED_EXTENSIONS:
-        raise FileExtensionNotAllowed("File format `{}` not in allowed list of file formats: {}"
-                                      .format(path_ext, ', '.join(ALLOWED_EXTENSIONS)))
-
-    final_content_type = None
-    content_set = False
-
-    for k, v in CONTENT_TYPE_CODES.items():
-
-        for value in v:
-            if value == path_ext:
-                final_content_type = k
-                content_set = True
-
-        if final_content_type in remote_content_types_list:
-            final_content_type = k
-            content_set = True
+    def __init__(self, remote_content_type_codes, file_formats=None, allowed_extensions=ALLOWED_EXTENSIONS):
+        """
+        :param list remote_content_type_codes: `content_type_codes` of the project
+        :param dict file_formats: content type code to extensions, see `add_project_file_formats`
+        :param dict allowed_extensions: extension to content type code. Codes not built in are overrides
+        """
+        self.remote_codes = [content_type['content_type_code'] for content_type in remote_content_type_codes or ()]
+        remote_codes = set(self.remote_codes)
 
-        if content_set:
+        candidates = OrderedDict()
+        for code, extensions in CONTENT_TYPE_CODES.items():
+            for extension in extensions:
+                candidates.setdefault(extension, []).append(code)
 
-            if not final_content_type:
-                raise FileExtensionNotAllowed("File format `{}` not in allowed list of file formats: {}. Or not specified as file format in your project (supported filefomats are: {})"
-                                          .format(path_ext, ', '.join(ALLOWED_EXTENSIONS), remote_content_types_list))
+        overrides = {ext: code for ext, code in allowed_extensions.items() if code not in candidates.get(ext, ())}
+        for code, extensions in (file_formats or {}).items():
+            for extension in extensions:
+                overrides[extension] = code
 
-            return final_content_type
+        self._codes = {}
+        for extension, codes in candidates.items():
+            self._codes[extension] = next((code for code in codes if code in remote_codes), codes[0])
+        self._codes.update(overrides)
 
-        else:
+    def get(self, extension):
+        """
+        :return: content type code or None if the extension is not allowed
+        """
+        return self._codes.get(extension)
 
-            continue
+    def resolve(self, path):
+        """
+        :param qordoba.sources.TranslationFile path:
+        :raise FileExtensionNotAllowed:
+        """
+        content_type_code = self._codes.get(path.extension)
+        if content_type_code is None:
+            raise FileExtensionNotAllowed("File format `{}` not in allowed list of file formats: {}"
+                                          .format(path.extension, ', '.join(sorted(self._codes))))
+        return content_type_code
 
 
+def get_content_type_resolver(remote_content_type_codes):
+    """
+    :param remote_content_type_codes: `content_type_codes` of the project or a ContentTypeResolver
+    :rtype: ContentTypeResolver
+    """
+    if isinstance(remote_content_type_codes, ContentTypeResolver):
+        return remote_content_type_codes
+    return ContentTypeResolver(remote_content_type_codes)
 
 
+def get_content_type_code(path, remote_content_type_codes):
+    """
+    :param qordoba.sources.TranslationFile path:
+    :param remote_content_type_codes: `content_type_codes` of the project. Pass a ContentTypeResolver
+        to avoid building the lookup for every call
+    :return: content type code
+    """
+    return get_content_type_resolver(remote_content_type_codes).resolve(path)
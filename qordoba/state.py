@@ -0,0 +1,316 @@
+from __future__ import unicode_literals, print_function
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+from qordoba.commands.utils import mkdirs
+from qordoba.sources import to_posix
+
+log = logging.getLogger('qordoba')
+
+STATE_DIR = '.qordoba'
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def file_digest(path, block_size=HASH_BLOCK_SIZE):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def replace_file(src, dst):
+    """
+    Atomically move `src` over `dst`.
+    """
+    try:
+        os.replace(src, dst)
+    except AttributeError:
+        # python27. os.rename doesn't overwrite files on Windows
+        if os.name == 'nt' and os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+
+class StateFile(object):
+    """
+    JSON document stored in the `.qordoba` directory of the project.
+    """
+    name = NotImplemented
+
+    def __init__(self, curdir):
+        self.path = os.path.join(curdir, STATE_DIR, self.name)
+        self._data = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = self.load()
+        return self._data
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except IOError:
+            return {}
+        except ValueError:
+            log.warning('Could not parse state file `{}`. It will be recreated.'.format(self.path))
+            return {}
+
+    def save(self):
+        if self._data is None:
+            return
+
+        dirname = os.path.dirname(self.path)
+        mkdirs(dirname)
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix='.{}.'.format(self.name))
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self._data, f, indent=1, sort_keys=True)
+            replace_file(tmp_path, self.path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+        log.debug('Saved state file `{}`'.format(self.path))
+
+
+class PushState(StateFile):
+    """
+    Content hash, size and mtime of every pushed file with its remote page ID, per project.
+    Allows push to skip files which didn't change since they were pushed last time.
+    """
+    name = 'push.json'
+
+    def __init__(self, curdir, project_id):
+        super(PushState, self).__init__(curdir)
+        self.project_id = str(project_id)
+
+    def load(self):
+        data = super(PushState, self).load()
+        # entries of the older format were not separated by project
+        return {key: value for key, value in data.items() if 'sha1' not in value}
+
+    @property
+    def entries(self):
+        return self.data.setdefault(self.project_id, {})
+
+    @staticmethod
+    def _key(path):
+        return to_posix(os.path.normpath(path.relpath))
+
+    def _get(self, path):
+        return self.entries.get(self._key(path))
+
+    def is_changed(self, path, version=None):
+        """
+        :param qordoba.sources.TranslationFile path:
+        :param str version: Version tag the file is pushed with
+        :rtype: bool
+        """
+        entry = self._get(path)
+        if entry is None or entry.get('version_tag') != version:
+            return True
+
+        stat = os.stat(path.fullpath)
+        if stat.st_size != entry['size']:
+            return True
+        if stat.st_mtime == entry['mtime']:
+            return False
+
+        # touched, but the content could be the same
+        if file_digest(path.fullpath) != entry['sha1']:
+            return True
+
+        entry['mtime'] = stat.st_mtime
+        return False
+
+    def get_page_id(self, path, version=None):
+        entry = self._get(path)
+        if entry is None or entry.get('version_tag') != version:
+            return None
+        return entry.get('page_id')
+
+    def record(self, path, page_id=None, version=None):
+        stat = os.stat(path.fullpath)
+        entry = self._get(path) or {}
+        if page_id is None and entry.get('version_tag') == version:
+            page_id = entry.get('page_id')
+
+        self.entries[self._key(path)] = {
+            'sha1': file_digest(path.fullpath),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'page_id': page_id,
+            'version_tag': version,
+        }
+
+
+class PullState(StateFile):
+    """
+    Last downloaded `update` timestamp and milestone for every (page, language, destination).
+    Allows incremental pull to download only the pages changed since the last pull.
+    A page pulled by several targets has an entry per destination.
+
+    Page details needed to plan the download are kept per (page, language) with the `update`
+    timestamp they belong to, so unchanged pages need no details request.
+    """
+    name = 'pull.json'
+
+    # page details fields used to build destination paths
+    DETAILS_FIELDS = ('id', 'name', 'version_tag', 'content_type_code')
+
+    def load(self):
+        data = super(PullState, self).load()
+        if not isinstance(data.get('files'), dict):
+            # older format without page details
+            return {}
+        return data
+
+    @property
+    def files(self):
+        return self.data.setdefault('files', {})
+
+    @property
+    def pages(self):
+        return self.data.setdefault('pages', {})
+
+    @staticmethod
+    def _key(page_id, language, dest_path):
+        return '{}:{}:{}'.format(page_id, language.code, dest_path.posix_path)
+
+    @staticmethod
+    def _page_key(page_id, language):
+        return '{}:{}'.format(page_id, language.code)
+
+    def is_changed(self, page, language, milestone, dest_path):
+        """
+        :param dict page: Page from `page_search` response
+        :param qordoba.languages.Language language:
+        :param milestone: Milestone the page is downloaded from
+        :param qordoba.sources.TranslationFile dest_path:
+        :rtype: bool
+        """
+        entry = self.files.get(self._key(page['page_id'], language, dest_path))
+        if entry is None:
+            return True
+
+        return entry['update'] != page.get('update') \
+            or entry['milestone'] != milestone \
+            or entry['path'] != dest_path.posix_path \
+            or not os.path.exists(dest_path.fullpath)
+
+    def record(self, page, language, milestone, dest_path):
+        self.files[self._key(page['page_id'], language, dest_path)] = {
+            'update': page.get('update'),
+            'milestone': milestone,
+            'path': dest_path.posix_path,
+        }
+
+    def get_details(self, page, language):
+        """
+        :param dict page: Page from `page_search` response
+        :return: page details recorded for the same `update` timestamp of the page or None
+        """
+        entry = self.pages.get(self._page_key(page['page_id'], language))
+        if entry is None or page.get('update') is None or entry['update'] != page['update']:
+            return None
+        return entry['details']
+
+    def record_details(self, page, language, details):
+        """
+        :param dict details: `get_page_details` response. Only the fields used for planning are kept
+        """
+        stored = {field: details.get(field) for field in self.DETAILS_FIELDS}
+        stored['status'] = {'id': details['status']['id'], 'name': details['status'].get('name')}
+        self.pages[self._page_key(page['page_id'], language)] = {
+            'update': page.get('update'),
+            'details': stored,
+        }
+
+
+class DownloadJournal(StateFile):
+    """
+    Downloads in progress with the URL they are fetched from.
+    Allows the next pull to resume interrupted downloads. Thread safe.
+    """
+    name = 'downloads.json'
+
+    def __init__(self, curdir):
+        super(DownloadJournal, self).__init__(curdir)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            return self.data.get(key)
+
+    def start(self, key, url, **params):
+        with self._lock:
+            self.data[key] = dict(params, url=url)
+            self._save()
+
+    def finish(self, key):
+        with self._lock:
+            if self.data.pop(key, None) is not None:
+                self._save()
+
+    def _save(self):
+        super(DownloadJournal, self).save()
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+
+class FindNewState(StateFile):
+    """
+    Classification result of every file checked by find_new with its mtime, size and inode.
+    Allows find_new to classify only the files changed since the last run.
+    """
+    name = 'find_new.json'
+
+    @staticmethod
+    def _key(relpath):
+        return to_posix(os.path.normpath(relpath))
+
+    @staticmethod
+    def _signature(stat):
+        mtime_ns = getattr(stat, 'st_mtime_ns', None)
+        if mtime_ns is None:
+            # python27
+            mtime_ns = int(stat.st_mtime * 1e9)
+        return [mtime_ns, stat.st_size, stat.st_ino]
+
+    def is_changed(self, relpath, stat):
+        """
+        :param str relpath: Path relative to the project
+        :param stat: `os.stat` result of the file
+        :rtype: bool
+        """
+        entry = self.data.get(self._key(relpath))
+        return entry is None or entry['stat'] != self._signature(stat)
+
+    def get_result(self, relpath):
+        return self.data[self._key(relpath)]['result']
+
+    def record(self, relpath, stat, result):
+        self.data[self._key(relpath)] = {
+            'stat': self._signature(stat),
+            'result': result,
+        }
+
+    def retain(self, relpaths):
+        """
+        Forget the files not in `relpaths`, e.g. removed since the last run.
+        """
+        keys = set(self._key(relpath) for relpath in relpaths)
+        for key in list(self.data):
+            if key not in keys:
+                del self.data[key]
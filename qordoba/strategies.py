@@ -1,45 +1,156 @@
 from __future__ import unicode_literals, print_function
 
+import hashlib
 import logging
 import os
+import pickle
+import tempfile
+import threading
+from collections import defaultdict
+
 import yaml
 
 from shebang import shebang
 
+from qordoba.cache import DEFAULT_CACHE_DIR
+from qordoba.commands.utils import mkdirs
+from qordoba.settings import get_cache_settings
+from qordoba.state import replace_file
+
 log = logging.getLogger('qordoba')
 
+LANGUAGES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'language.yml')
+
+
+class LanguageIndex(object):
+    """
+    Extension and filename lookup tables built from linguist's language.yml.
+
+    Parsing the YAML is slow, so the tables are pickled into the cache directory
+    under the SHA1 of the YAML and reused until language.yml changes.
+    The `cache` settings of .qordoba.yml apply, see `init_language_index`.
+    """
+
+    def __init__(self, extensions, filenames):
+        """
+        :param dict extensions: lowercase extension (with the leading dot) -> list of language names
+        :param dict filenames: file name -> list of language names
+        """
+        self.extensions = extensions
+        self.filenames = filenames
+
+    @classmethod
+    def from_languages(cls, languages):
+        """
+        :param dict languages: Parsed language.yml document
+        """
+        extensions = defaultdict(list)
+        filenames = defaultdict(list)
+        for name, attributes in (languages or {}).items():
+            attributes = attributes or {}
+            for ext in attributes.get('extensions') or ():
+                extensions[ext.lower()].append(name)
+            for filename in attributes.get('filenames') or ():
+                filenames[filename].append(name)
+        return cls(dict(extensions), dict(filenames))
+
+    @classmethod
+    def load(cls, path=LANGUAGES_PATH, cache_dir=None, use_cache=True):
+        with open(path, 'rb') as f:
+            content = f.read()
+
+        if not use_cache:
+            return cls.from_languages(yaml.safe_load(content))
+
+        cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        cache_path = os.path.join(cache_dir, 'languages-{}.pickle'.format(hashlib.sha1(content).hexdigest()))
+        try:
+            with open(cache_path, 'rb') as f:
+                extensions, filenames = pickle.load(f)
+            return cls(extensions, filenames)
+        except (IOError, OSError):
+            pass
+        except Exception as e:
+            log.debug('Broken language index cache `{}` ignored: {}'.format(cache_path, e))
+
+        index = cls.from_languages(yaml.safe_load(content))
+        index._store(cache_path)
+        return index
+
+    def _store(self, cache_path):
+        dirname = os.path.dirname(cache_path)
+        try:
+            mkdirs(dirname)
+            fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix='.languages.')
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((self.extensions, self.filenames), f, protocol=2)
+            replace_file(tmp_path, cache_path)
+        except (IOError, OSError) as e:
+            log.debug('Could not write language index cache `{}`: {}'.format(cache_path, e))
+
+    def by_extension(self, filename):
+        """
+        Languages of the longest known extension of `filename`, e.g. `.d.ts` before `.ts`.
+        :rtype: list
+        """
+        name = os.path.basename(filename).lower()
+        start = name.find('.', 1)
+        while start != -1:
+            languages = self.extensions.get(name[start:])
+            if languages:
+                return list(languages)
+            start = name.find('.', start + 1)
+        return []
+
+    def by_filename(self, filename):
+        """
+        :rtype: list
+        """
+        return list(self.filenames.get(os.path.basename(filename), ()))
+
+
+_LANGUAGE_INDEX = None
+_LANGUAGE_INDEX_LOCK = threading.Lock()
+
+
+def init_language_index(config):
+    """
+    Load the language index with the `cache` settings of .qordoba.yml.
+    Worker processes forked afterwards share it.
+    """
+    global _LANGUAGE_INDEX
+    cache_settings = get_cache_settings(config)
+    with _LANGUAGE_INDEX_LOCK:
+        _LANGUAGE_INDEX = LanguageIndex.load(cache_dir=cache_settings['path'], use_cache=cache_settings['enabled'])
+    return _LANGUAGE_INDEX
+
+
+def get_language_index():
+    global _LANGUAGE_INDEX
+    with _LANGUAGE_INDEX_LOCK:
+        if _LANGUAGE_INDEX is None:
+            _LANGUAGE_INDEX = LanguageIndex.load()
+        return _LANGUAGE_INDEX
+
+
 class Extension(object):
-    def __init__(self):
-        pass
+    def __init__(self, index=None):
+        self._index = index
+
+    @property
+    def index(self):
+        return self._index or get_language_index()
 
     def reveal_extension(self, blob):
         filename, file_extension = os.path.splitext(blob)
         return file_extension
 
-    def find_ext(self, d, tag):
-        if tag in d:
-            yield d[tag]
-        for k, v in d.items():
-            if isinstance(v, dict):
-                for i in self.find_ext(v, tag):
-                    yield i, k
-
     def find(self, blob):
-        extension = self.reveal_extension(blob)
-
-        with open("language.yml", 'r') as stream:
-            try:
-                data = (yaml.load(stream))
-                languages = []
-                for ext_key_value in self.find_ext(data, 'extensions'):
-                    (ext_list, ext_key) = ext_key_value
-                    for ext in ext_list:
-                        if ext == extension:
-                            languages.append(ext_key)
-                log.info('File `{}` with extension {} most certainly is of type {}'.format( blob.split('/')[-1:][0], extension, languages[0] ))
-                return languages
-            except yaml.YAMLError as exc:
-                print(exc)
+        languages = self.index.by_extension(blob)
+        if languages:
+            log.info('File `{}` with extension {} most certainly is of type {}'.format(
+                os.path.basename(blob), self.reveal_extension(blob), languages[0]))
+        return languages
 
 
 class Shebang():
@@ -47,16 +158,9 @@ class Shebang():
         pass
 
     def spot_shebang(self, blob):
-        # shebang = parseshebang.parse(blob)
-        # os.subprocess.check_call(shebang + ["/my_script.py"])
-        # print(shebang)
-        print(shebang(blob))
-        # firstLine = open(blob, 'r').readline()
-        # if firstLine[:2] == '#!':
-        #     return True
-        # else:
-        #     return False
-
+        interpreter = shebang(blob)
+        log.debug('Shebang of file `{}`: {}'.format(os.path.basename(blob), interpreter))
+        return interpreter
 
     def find(self, blob):
         if self.spot_shebang(blob):
@@ -64,25 +168,19 @@ class Shebang():
         log.info('Strategy Shebang does not apply for file `{}`'.format(blob.split('/')[-1:][0]))
 
 
-def Filename():
-    def __init__():
-        pass
+class Filename(object):
+    def __init__(self, index=None):
+        self._index = index
+
+    @property
+    def index(self):
+        return self._index or get_language_index()
 
     def reveal_filename(self, blob):
-        filename, file_extension = os.path.splitext(blob)
-        return filename
+        return os.path.basename(blob)
 
     def find(self, blob):
-        filename = self.reveal_filename(blob)
-
-        with open("language.yml", 'r') as stream:
-            try:
-                data = (yaml.load(stream))
-                languages = []
-                for filename_key_value in self.find_ext(data, 'filenames'):
-                    assert isinstance(filename_key_value, object)
-                    (filename_key, filename_value) = filename_key_value
-                    if filename == filename_value:
-                        languages.append()
-            except:
-                pass
+        languages = self.index.by_filename(blob)
+        if languages:
+            log.info('File `{}` most certainly is of type {}'.format(self.reveal_filename(blob), languages[0]))
+        return languages
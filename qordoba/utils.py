@@ -5,6 +5,7 @@ import sys
 
 import itertools
 from argparse import ArgumentTypeError
+from multiprocessing.pool import ThreadPool
 
 import furl as furl
 
@@ -89,3 +90,22 @@ class CommaSeparatedSet(object):
 
         return values
 
+
+def run_parallel(func, iterable, jobs=1):
+    """
+    Apply `func` to every item of `iterable` using a pool of `jobs` threads.
+    Results are yielded in the order of the input, so callers can log them deterministically.
+    With jobs <= 1 items are processed one by one in the current thread.
+    """
+    if not jobs or jobs <= 1:
+        for item in iterable:
+            yield func(item)
+        return
+
+    pool = ThreadPool(jobs)
+    try:
+        for result in pool.imap(func, iterable):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
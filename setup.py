@@ -26,12 +26,13 @@ setup(
     dependency_links=[],
     setup_requires=[],
     install_requires=get_requirements('requirements.txt').splitlines(),
+    extras_require={'async': ['aiohttp']},
     data_files=[],
     test_suite="tests",
     zip_safe=False,
     packages=packages,
     include_package_data=True,
-    package_data={},
+    package_data={'qordoba': ['*.yml']},
     classifiers=[
         'Programming Language :: Python',
         'Programming Language :: Python :: 2.7',
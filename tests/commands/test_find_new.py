@@ -1 +1,101 @@
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
 
+import pytest
+
+from qordoba.commands.find_new import inspect_file, not_valid, classify_files, write_results
+from qordoba.state import FindNewState
+
+
+@pytest.fixture(autouse=True)
+def language_index(language_cache_dir):
+    return language_cache_dir
+
+
+@pytest.fixture
+def files_dir():
+    path = tempfile.mkdtemp()
+    for name, content in (('empty.txt', b''), ('strings.json', b'{"key": "value"}'),
+                          ('image.png', b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR' * 10)):
+        with open(os.path.join(path, name), 'wb') as f:
+            f.write(content)
+    yield path
+    shutil.rmtree(path)
+
+
+def test_inspect_file(files_dir):
+    info = inspect_file(os.path.join(files_dir, 'strings.json'))
+    assert not info.binary
+    assert not info.empty
+    assert info.encoding == 'us-ascii'
+
+    assert inspect_file(os.path.join(files_dir, 'empty.txt')).empty
+    assert inspect_file(os.path.join(files_dir, 'image.png')).binary
+
+
+def test_not_valid(files_dir):
+    assert not not_valid(os.path.join(files_dir, 'strings.json'))
+    assert not_valid(os.path.join(files_dir, 'empty.txt'))
+    assert not_valid(os.path.join(files_dir, 'image.png'))
+
+
+def test_classify_files(files_dir, monkeypatch):
+    monkeypatch.setattr('qordoba.commands.find_new.INLINE_CLASSIFY_LIMIT', 0)
+    items = [(os.path.join(files_dir, name), name) for name in ('strings.json', 'empty.txt', 'image.png')] * 3
+
+    results = list(classify_files(items, jobs=2))
+
+    assert len(results) == 9
+    assert [r['path'] if r else None for r in results[:3]] == ['strings.json', None, None]
+    assert results[0]['encoding'] == 'us-ascii'
+    assert results[0]['strategies']['Extension'][0] == 'JSON'
+
+
+def test_classify_files_without_pool(files_dir, monkeypatch):
+    items = [(os.path.join(files_dir, name), name) for name in ('strings.json', 'empty.txt', 'image.png')]
+    state = FindNewState(files_dir)
+    first = list(classify_files(items, jobs=4, state=state))
+
+    def no_pool(*args, **kwargs):
+        raise AssertionError('worker pool started')
+
+    monkeypatch.setattr('multiprocessing.Pool', no_pool)
+    # nothing changed
+    assert list(classify_files(items, jobs=4, state=state)) == first
+    assert list(classify_files(items, jobs=4, state=state, ordered=False)) == [first[0], None, None]
+
+
+def test_classify_files_quiet(files_dir, capsys):
+    list(classify_files([(os.path.join(files_dir, 'strings.json'), 'strings.json')], jobs=1))
+
+    # stdout is reserved for the JSON Lines output
+    assert capsys.readouterr().out == ''
+
+
+def test_write_results():
+    output = StringIO()
+
+    assert write_results([{'path': 'a.json'}, None, {'path': 'b.json'}], output) == 2
+    assert [json.loads(line) for line in output.getvalue().splitlines()] == [{'path': 'a.json'}, {'path': 'b.json'}]
+
+
+def test_classify_files_state(files_dir, monkeypatch):
+    items = [(os.path.join(files_dir, name), name) for name in ('strings.json', 'empty.txt', 'image.png')]
+    state = FindNewState(files_dir)
+
+    first = list(classify_files(items, jobs=1, state=state))
+    state.save()
+
+    classified = []
+    monkeypatch.setattr('qordoba.commands.find_new.classify_file', lambda item: classified.append(item))
+    state = FindNewState(files_dir)
+    assert list(classify_files(items, jobs=1, state=state)) == first
+    assert classified == []
+
+    with open(os.path.join(files_dir, 'empty.txt'), 'wb') as f:
+        f.write(b'now with some text')
+    list(classify_files(items, jobs=1, state=state))
+    assert classified == [items[1]]
@@ -10,10 +10,15 @@ except ImportError:
 
 import pytest
 import shutil
+import zipfile
 from mock import MagicMock
-from qordoba.commands.pull import pull_command, validate_languges_input
+from qordoba.commands.pull import pull_command, validate_languges_input, pull_bulk, BULK_DOWNLOAD_DIR, \
+    download_task, DownloadTask, DownloadIncomplete, PART_SUFFIX
 from qordoba.languages import Language
-from qordoba.project import ResponsePaginatedResult, PageStatus
+from qordoba.project import ResponsePaginatedResult, PageStatus, ProjectAPI, create_session
+from qordoba.settings import get_http_settings
+from qordoba.sources import validate_path
+from qordoba.state import DownloadJournal
 
 
 @pytest.fixture
@@ -193,3 +198,293 @@ def test_pull_exists_replace(mock_api, mock_tmp_dir,
     mock_api.download_file.assert_called_with(page_details_response['id'], lang_ru.id, milestone=None)
 
     assert os.path.exists(os.path.join(mock_tmp_dir, 'ru-ru.json'))
+
+
+def test_pull_jobs(mock_api, mock_tmp_dir,
+                   project_response,
+                   page_search_paginated,
+                   language_response,
+                   page_details_response):
+    page_details_response['version_tag'] = None
+    mock_api.get_languages.return_value = language_response
+    mock_api.get_project.return_value = project_response
+    mock_api.page_search.return_value = page_search_paginated
+    mock_api.get_page_details.return_value = page_details_response
+    mock_api.download_file.side_effect = lambda *args, **kwargs: MagicMock(raw=StringIO(b'test'), url='url', headers={})
+
+    pull_command(mock_tmp_dir, {}, jobs=4)
+
+    assert mock_api.download_file.call_count == 3
+    for code in ('ru-ru', 'en-gb', 'ja-jp'):
+        assert os.path.exists(os.path.join(mock_tmp_dir, '{}-test.json'.format(code)))
+
+
+def test_pull_incremental(mock_api, mock_tmp_dir,
+                          project_response,
+                          page_search_response,
+                          language_response,
+                          page_details_response):
+    page_details_response['version_tag'] = None
+    mock_api.get_languages.return_value = language_response
+    mock_api.get_project.return_value = project_response
+    mock_api.page_search.side_effect = lambda *args, **kwargs: ResponsePaginatedResult(
+        'pages', lambda *a, **kw: page_search_response, (), {})
+    mock_api.get_page_details.return_value = page_details_response
+    mock_api.download_file.side_effect = lambda *args, **kwargs: MagicMock(raw=StringIO(b'test'), url='url', headers={})
+
+    pull_command(mock_tmp_dir, {}, languages=('ru-ru',), incremental=True)
+    assert mock_api.download_file.call_count == 1
+
+    pull_command(mock_tmp_dir, {}, languages=('ru-ru',), incremental=True)
+    assert mock_api.download_file.call_count == 1
+    # unchanged pages are planned from the state, without details requests
+    assert mock_api.get_page_details.call_count == 1
+
+    page_search_response['pages'][0]['update'] += 1000
+    pull_command(mock_tmp_dir, {}, languages=('ru-ru',), incremental=True, force=True)
+    assert mock_api.download_file.call_count == 2
+
+
+def test_pull_incremental_targets(mock_api, mock_tmp_dir,
+                                  project_response,
+                                  page_search_response,
+                                  language_response,
+                                  page_details_response):
+    page_details_response['version_tag'] = None
+    mock_api.get_languages.return_value = language_response
+    mock_api.get_project.return_value = project_response
+    mock_api.page_search.side_effect = lambda *args, **kwargs: ResponsePaginatedResult(
+        'pages', lambda *a, **kw: page_search_response, (), {})
+    mock_api.get_page_details.return_value = page_details_response
+    mock_api.download_file.side_effect = lambda *args, **kwargs: MagicMock(raw=StringIO(b'test'), url='url', headers={})
+    config = {'pull': {'targets': ['i18n/<language_code>.json', 'other/<language_code>.json']}}
+
+    pull_command(mock_tmp_dir, config, languages=('ru-ru',), incremental=True)
+    assert mock_api.download_file.call_count == 2
+
+    pull_command(mock_tmp_dir, config, languages=('ru-ru',), incremental=True)
+    assert mock_api.download_file.call_count == 2
+
+
+def test_pull_page_details_reused(mock_api, mock_tmp_dir,
+                                  project_response,
+                                  page_search_response,
+                                  language_response,
+                                  page_details_response):
+    page_details_response['version_tag'] = None
+    mock_api.get_languages.return_value = language_response
+    mock_api.get_project.return_value = project_response
+    mock_api.page_search.side_effect = lambda *args, **kwargs: ResponsePaginatedResult(
+        'pages', lambda *a, **kw: page_search_response, (), {})
+    mock_api.get_page_details.return_value = page_details_response
+    mock_api.download_file.side_effect = lambda *args, **kwargs: MagicMock(raw=StringIO(b'test'), url='url', headers={})
+    config = {'pull': {'targets': ['i18n/<language_code>.json', 'other/<language_code>.json']}}
+
+    pull_command(mock_tmp_dir, config, jobs=2)
+
+    assert mock_api.page_search.call_count == 3
+    assert mock_api.get_page_details.call_count == 3
+    assert mock_api.download_file.call_count == 6
+    assert os.path.exists(os.path.join(mock_tmp_dir, 'other', 'ja-jp.json'))
+
+
+def test_pull_same_destination_downloaded_once(mock_api, mock_tmp_dir,
+                                              project_response,
+                                              page_search_response,
+                                              language_response,
+                                              page_details_response):
+    page_details_response['version_tag'] = None
+    mock_api.get_languages.return_value = language_response
+    mock_api.get_project.return_value = project_response
+    mock_api.page_search.side_effect = lambda *args, **kwargs: ResponsePaginatedResult(
+        'pages', lambda *a, **kw: page_search_response, (), {})
+    mock_api.get_page_details.return_value = page_details_response
+    mock_api.download_file.side_effect = lambda *args, **kwargs: MagicMock(raw=StringIO(b'test'), url='url', headers={})
+    config = {'pull': {'targets': ['i18n/<language_code>.json', 'i18n/<language_code>.json']}}
+
+    pull_command(mock_tmp_dir, config, force=True, jobs=4)
+
+    assert mock_api.download_file.call_count == 3
+    assert os.path.exists(os.path.join(mock_tmp_dir, 'i18n', 'ja-jp.json'))
+
+
+def test_pull_bulk_page_details_once(mock_api, mock_tmp_dir,
+                                     project_response,
+                                     page_search_response,
+                                     language_response,
+                                     page_details_response):
+    page_details_response['version_tag'] = None
+    mock_api.get_languages.return_value = language_response
+    mock_api.get_project.return_value = project_response
+    mock_api.page_search.side_effect = lambda *args, **kwargs: ResponsePaginatedResult(
+        'pages', lambda *a, **kw: page_search_response, (), {})
+    mock_api.get_page_details.return_value = page_details_response
+    mock_api.stream_file.side_effect = lambda url, f: f.write(_empty_archive())
+
+    pull_command(mock_tmp_dir, {}, bulk=True)
+
+    mock_api.get_page_details.assert_called_once()
+
+
+def test_pull_in_progress_workflow_searches_once(mock_api, mock_tmp_dir,
+                                                project_response,
+                                                page_search_response,
+                                                language_response,
+                                                page_details_response):
+    page_details_response['version_tag'] = None
+    mock_api.get_languages.return_value = language_response
+    mock_api.get_project.return_value = project_response
+    mock_api.page_search.side_effect = lambda *args, **kwargs: ResponsePaginatedResult(
+        'pages', lambda *a, **kw: page_search_response, (), {})
+    mock_api.get_page_details.return_value = page_details_response
+    mock_api.get_milestone.return_value = [{'name': 'Editing', 'id': 7952}]
+    mock_api.download_file.side_effect = lambda *args, **kwargs: MagicMock(raw=StringIO(b'test'), url='url', headers={})
+
+    pull_command(mock_tmp_dir, {}, languages=('ru-ru',), in_progress=True, workflow_all='Editing')
+
+    mock_api.page_search.assert_called_once_with(190, status=[PageStatus.enabled, ])
+    mock_api.download_file.assert_called_once()
+
+
+def _empty_archive():
+    archive = StringIO()
+    zipfile.ZipFile(archive, 'w').close()
+    return archive.getvalue()
+
+
+def _bulk_api(members):
+    archive = StringIO()
+    with zipfile.ZipFile(archive, 'w') as z:
+        for name, content in members:
+            z.writestr(name, content)
+
+    api = MagicMock()
+    api.download_files.return_value = 'https://storage/archive.zip'
+    api.stream_file.side_effect = lambda url, f: f.write(archive.getvalue())
+    return api
+
+
+def test_pull_bulk(mock_tmp_dir):
+    api = _bulk_api([('ru-ru/test.json', 'ru'), ('en-us/test.json', 'en'), ('ja-jp/test.json', 'ja'),
+                     ('ja-jp/../../escape.json', 'escape')])
+
+    src_to_dest_paths = [('ru-ru', 'test.json', os.path.join(mock_tmp_dir, 'i18n', 'ru-ru', 'test.json'))]
+    pull_bulk(api, src_to_dest_paths, [1, 1], [94, 190], pattern='i18n/<language_code>/test.json')
+
+    with open(os.path.join(mock_tmp_dir, 'i18n', 'ru-ru', 'test.json')) as f:
+        assert f.read() == 'ru'
+    assert os.path.exists(os.path.join(mock_tmp_dir, BULK_DOWNLOAD_DIR, 'en-us', 'test.json'))
+    assert os.path.exists(os.path.join(mock_tmp_dir, BULK_DOWNLOAD_DIR, 'ja-jp', 'test.json'))
+    assert not os.path.exists(os.path.join(mock_tmp_dir, 'escape.json'))
+
+
+def test_pull_bulk_filename_pattern(mock_api, mock_tmp_dir,
+                                    project_response,
+                                    page_search_response,
+                                    language_response,
+                                    page_details_response):
+    page_details_response['version_tag'] = None
+    page_details_response['name'] = 'server.yml'
+    mock_api.get_languages.return_value = language_response
+    mock_api.get_project.return_value = project_response
+    mock_api.page_search.side_effect = lambda *args, **kwargs: ResponsePaginatedResult(
+        'pages', lambda *a, **kw: page_search_response, (), {})
+    mock_api.get_page_details.return_value = page_details_response
+    mock_api.stream_file.side_effect = _bulk_api([('ru-ru/server.yml', 'ru'), ('ja-jp/server.yml', 'ja'),
+                                                  ('en-us/server.yml', 'new en')]).stream_file.side_effect
+    locales = os.path.join(mock_tmp_dir, 'config', 'locales')
+    os.makedirs(locales)
+    with open(os.path.join(locales, 'server.en-us.yml'), 'w') as f:
+        f.write('en')
+    config = {'pull': {'targets': ['config/locales/server.<language_code>.yml']}}
+
+    pull_command(mock_tmp_dir, config, bulk=True)
+
+    for code, content in (('ru-ru', 'ru'), ('ja-jp', 'ja'), ('en-us', 'en')):
+        with open(os.path.join(locales, 'server.{}.yml'.format(code))) as f:
+            assert f.read() == content
+    assert not os.path.exists(os.path.join(locales, 'server.yml'))
+    with open(os.path.join(mock_tmp_dir, BULK_DOWNLOAD_DIR, 'en-us', 'server.yml')) as f:
+        assert f.read() == 'new en'
+
+    pull_command(mock_tmp_dir, config, bulk=True, force=True)
+
+    with open(os.path.join(locales, 'server.en-us.yml')) as f:
+        assert f.read() == 'new en'
+
+
+@pytest.fixture
+def download_server(http_server):
+    content = b'0123456789' * 10
+
+    def raw_file(handler):
+        range_header = handler.headers.get('Range')
+        if range_header:
+            offset = int(range_header.split('=')[1].rstrip('-'))
+            headers = {'Content-Range': 'bytes {}-{}/{}'.format(offset, len(content) - 1, len(content))}
+            return 206, headers, content[offset:]
+        return 200, {}, content
+
+    http_server.add_route('/api/projects/1/languages/190/pages/1/segments/milestones/-100/export',
+                          (200, {}, {'token': 'token', 'filename': 'test.json'}))
+    http_server.add_route('/api/file/download', raw_file)
+    http_server.content = content
+    return http_server
+
+
+@pytest.fixture
+def download_api():
+    config = {'access_token': 'token', 'project_id': 1, 'cache': {'enabled': False}}
+    return ProjectAPI(config, session=create_session(get_http_settings(config)))
+
+
+def test_download_task_resume(download_server, download_api, mock_tmp_dir, mock_lang_storage, lang_ru):
+    dest_path = validate_path(mock_tmp_dir, 'ru-ru.json', lang_ru)
+    task = DownloadTask({'page_id': 1, 'update': 1}, 1, lang_ru, None, dest_path)
+    journal = DownloadJournal(mock_tmp_dir)
+
+    with open(dest_path.native_path + PART_SUFFIX, 'wb') as f:
+        f.write(download_server.content[:30])
+    journal.start(dest_path.posix_path, download_server.url + 'api/file/download?token=token&filename=test.json',
+                  page_id=1, language_id=lang_ru.id, milestone=None, update=1)
+
+    download_task(download_api, task, journal=journal)
+
+    _, _, headers, _ = download_server.requests[-1]
+    assert headers['Range'] == 'bytes=30-'
+    with open(dest_path.native_path, 'rb') as f:
+        assert f.read() == download_server.content
+    assert not os.path.exists(dest_path.native_path + PART_SUFFIX)
+    assert DownloadJournal(mock_tmp_dir).get(dest_path.posix_path) is None
+
+
+def test_download_task_journal_outdated(download_server, download_api, mock_tmp_dir, mock_lang_storage, lang_ru):
+    dest_path = validate_path(mock_tmp_dir, 'ru-ru.json', lang_ru)
+    task = DownloadTask({'page_id': 1, 'update': 2}, 1, lang_ru, None, dest_path)
+    journal = DownloadJournal(mock_tmp_dir)
+
+    with open(dest_path.native_path + PART_SUFFIX, 'wb') as f:
+        f.write(b'old content')
+    journal.start(dest_path.posix_path, download_server.url + 'api/file/download?token=old&filename=test.json',
+                  page_id=1, language_id=lang_ru.id, milestone=None, update=1)
+
+    download_task(download_api, task, journal=journal)
+
+    assert all('Range' not in headers for _, _, headers, _ in download_server.requests)
+    with open(dest_path.native_path, 'rb') as f:
+        assert f.read() == download_server.content
+
+
+def test_download_task_interrupted(mock_tmp_dir, mock_lang_storage, lang_ru):
+    dest_path = validate_path(mock_tmp_dir, 'ru-ru.json', lang_ru)
+    task = DownloadTask({'page_id': 1, 'update': 1}, 1, lang_ru, None, dest_path)
+    journal = DownloadJournal(mock_tmp_dir)
+    api = MagicMock()
+    api.download_file.return_value = MagicMock(raw=StringIO(b'0123'), url='url', headers={'Content-Length': '10'})
+
+    with pytest.raises(DownloadIncomplete):
+        download_task(api, task, journal=journal)
+
+    assert not os.path.exists(dest_path.native_path)
+    assert os.path.exists(dest_path.native_path + PART_SUFFIX)
+    assert DownloadJournal(mock_tmp_dir).get(dest_path.posix_path)['url'] == 'url'
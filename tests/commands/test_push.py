@@ -3,7 +3,8 @@ import os
 import pytest
 from mock import MagicMock
 
-from qordoba.commands.push import select_version_tag, select_source_columns, push_command, update_file, upload_file
+from qordoba.commands.push import select_version_tag, select_source_columns, push_command, update_file, upload_file, \
+    upload_files, push_files, RemotePageIndex
 from qordoba.languages import Language
 from qordoba.settings import PatternNotFound
 from qordoba.sources import validate_path
@@ -16,6 +17,15 @@ def mock_api(monkeypatch):
     return api_mock.return_value
 
 
+@pytest.fixture(autouse=True)
+def mock_push_state(monkeypatch):
+    mock = MagicMock()
+    mock.return_value.is_changed.return_value = True
+    mock.return_value.get_page_id.return_value = None
+    monkeypatch.setattr('qordoba.commands.push.PushState', mock)
+    return mock.return_value
+
+
 @pytest.fixture
 def mock_change_dir(monkeypatch, curdir):
     root = os.path.abspath(curdir)
@@ -141,7 +151,7 @@ def test_push_command_update(mock_api, mock_change_dir,
                              project_response):
     mock_api.get_languages.return_value = language_response
     mock_api.get_project.return_value = project_response
-    mock_api.page_search.return_value = ('test',)
+    mock_api.page_search.return_value = [{'page_id': 1, 'url': 'test.json', 'version_tag': None}]
 
     push_command(mock_change_dir, {}, update=True, files=(os.path.join(mock_change_dir, 'test.json'),))
 
@@ -162,3 +172,104 @@ def test_upload_file(mock_api, mock_change_dir,
 
     mock_api.upload_anytype_file.assert_called_once()
     mock_api.append_file.assert_called_with(1, 'test.json', version_tag='v1')
+
+
+def test_upload_files_batch(mock_api, mock_change_dir,
+                            mock_lang_storage,
+                            project_response,
+                            lang_en_us):
+    mock_api.upload_anytype_file.side_effect = lambda f, file_name, *args, **kwargs: {'upload_id': file_name}
+    mock_api.append_files.return_value = {}
+    paths = [validate_path(mock_change_dir, name, lang_en_us)
+             for name in ('sources/sampleA.json', 'sources/sampleB.json', 'test.json')]
+
+    list(upload_files(mock_api, paths, project_response['content_type_codes'], jobs=2, batch_size=2))
+
+    assert mock_api.upload_anytype_file.call_count == 3
+    assert mock_api.append_files.call_count == 2
+    mock_api.append_file.assert_not_called()
+
+    first_batch, = mock_api.append_files.call_args_list[0][0]
+    second_batch, = mock_api.append_files.call_args_list[1][0]
+    assert [item['upload_id'] for item in first_batch] == ['sampleA.json', 'sampleB.json']
+    assert [item['upload_id'] for item in second_batch] == ['test.json']
+
+
+def test_upload_files_page_ids(mock_api, mock_change_dir,
+                               mock_lang_storage,
+                               project_response,
+                               lang_en_us):
+    mock_api.upload_anytype_file.side_effect = lambda f, file_name, *args, **kwargs: {'upload_id': file_name}
+    mock_api.append_files.side_effect = ([{'page_id': 1}, {'page_id': 2}], Exception('append failed'))
+    paths = [validate_path(mock_change_dir, name, lang_en_us)
+             for name in ('sources/sampleA.json', 'sources/sampleB.json', 'test.json')]
+
+    uploaded = []
+    with pytest.raises(Exception):
+        for path, page_id in upload_files(mock_api, paths, project_response['content_type_codes'], batch_size=2):
+            uploaded.append((path.unique_name, page_id))
+
+    assert uploaded == [('sampleA.json', 1), ('sampleB.json', 2)]
+
+
+def test_push_files_skips_unchanged(mock_api, mock_change_dir,
+                                    mock_lang_storage,
+                                    project_response):
+    state = MagicMock()
+    state.is_changed.return_value = False
+
+    push_files(project_response, mock_change_dir, ['test.json'], mock_api, True, None,
+               project_response['content_type_codes'], state=state)
+
+    state.is_changed.assert_called_once()
+    mock_api.page_search.assert_not_called()
+    mock_api.upload_anytype_file.assert_not_called()
+    mock_api.update_upload_anyType_file.assert_not_called()
+
+
+def test_push_command_skips_unchanged(mock_api, mock_change_dir,
+                                     mock_push_state,
+                                     mock_update,
+                                     mock_upload,
+                                     language_response,
+                                     project_response):
+    mock_api.get_languages.return_value = language_response
+    mock_api.get_project.return_value = project_response
+    mock_push_state.is_changed.return_value = False
+
+    push_command(mock_change_dir, {}, update=True, files=(os.path.join(mock_change_dir, 'test.json'),))
+
+    mock_push_state.is_changed.assert_called_once()
+    mock_push_state.save.assert_called_once()
+    mock_api.page_search.assert_not_called()
+    mock_api.upload_anytype_file.assert_not_called()
+    mock_update.assert_not_called()
+
+
+def test_push_files_updates_known_page(mock_api, mock_change_dir,
+                                       mock_lang_storage,
+                                       project_response):
+    state = MagicMock()
+    state.is_changed.return_value = True
+    state.get_page_id.return_value = 42
+    mock_api.update_upload_anyType_file.return_value = {'id': 'upload'}
+
+    push_files(project_response, mock_change_dir, ['test.json'], mock_api, True, None,
+               project_response['content_type_codes'], state=state)
+
+    mock_api.page_search.assert_not_called()
+    mock_api.apply_upload_file.assert_called_once_with('upload', 42)
+    assert state.record.call_args[1]['page_id'] == 42
+
+
+def test_remote_page_index(mock_api):
+    mock_api.page_search.return_value = [
+        {'page_id': 1, 'url': 'test.json', 'version_tag': None},
+        {'page_id': 2, 'url': 'test.json', 'version_tag': 'v2'},
+        {'page_id': 3, 'url': 'old-test.json', 'version_tag': None},
+    ]
+    index = RemotePageIndex(mock_api, 94)
+
+    assert [page['page_id'] for page in index.find('test.json')] == [1, 2]
+    assert index.find('test') == []
+    mock_api.page_search.assert_called_once_with(language_id=94)
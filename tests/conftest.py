@@ -1,5 +1,8 @@
 import json
 import os
+import shutil
+import sys
+import tempfile
 
 import pytest
 
@@ -7,6 +10,11 @@ from mock import MagicMock
 
 from qordoba.languages import init_language_storage
 from qordoba.settings import load_settings
+from tests.server import LocalServer
+
+collect_ignore = []
+if sys.version_info < (3, 6):
+    collect_ignore.append('test_project_async.py')
 
 
 @pytest.fixture
@@ -85,3 +93,24 @@ def curdir():
 @pytest.fixture
 def projectdir(curdir):
     return os.path.abspath(os.path.join(curdir, '../'))
+
+
+@pytest.fixture
+def http_server(monkeypatch):
+    server = LocalServer()
+    server.start()
+    monkeypatch.setattr('qordoba.project.API_URL', server.url + 'api/')
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def language_cache_dir(monkeypatch):
+    """
+    Keeps the language index cache out of the user's cache directory.
+    """
+    path = tempfile.mkdtemp()
+    monkeypatch.setattr('qordoba.strategies.DEFAULT_CACHE_DIR', path)
+    monkeypatch.setattr('qordoba.strategies._LANGUAGE_INDEX', None)
+    yield path
+    shutil.rmtree(path)
@@ -0,0 +1,88 @@
+import json
+import threading
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+
+__all__ = ('LocalServer', )
+
+
+class _ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        path = self.path.split('?', 1)[0]
+        self.server.local.requests.append((self.command, self.path, dict(self.headers), body))
+
+        route = self.server.local.routes.get((self.command, path)) or self.server.local.routes.get((None, path))
+        if route is None:
+            status, headers, content = 404, {}, b''
+        elif callable(route):
+            status, headers, content = route(self)
+        else:
+            status, headers, content = route
+
+        if isinstance(content, (dict, list)):
+            content = json.dumps(content).encode('utf-8')
+            headers = dict(headers, **{'Content-Type': 'application/json'})
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if callable(content):
+            # writes the body itself, e.g. to break the connection in the middle of it
+            self.end_headers()
+            content(self)
+            self.close_connection = True
+            return
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+
+class LocalServer(object):
+    """
+    Keep-alive HTTP server on localhost which serves canned responses.
+
+    Routes map `(method, path)` or `(None, path)` to a `(status, headers, body)` tuple
+    or to a callable receiving the request handler and returning such a tuple.
+    The body may be a callable writing the content to the handler itself.
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self.requests = []
+        self._server = _ThreadingServer(('127.0.0.1', 0), _Handler)
+        self._server.local = self
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/'.format(self._server.server_address[1])
+
+    def add_route(self, path, response, method=None):
+        self.routes[(method, path)] = response
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,33 @@
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from qordoba.cache import ResponseCache
+
+
+@pytest.fixture
+def cache_dir():
+    path = tempfile.mkdtemp()
+    yield path
+    shutil.rmtree(path)
+
+
+def test_store_load(cache_dir):
+    cache = ResponseCache(path=cache_dir)
+    cache.store('key', {'id': 1}, validators={'etag': '"v1"'}, size=9)
+
+    entry = cache.load('key')
+    assert entry['body'] == {'id': 1}
+    assert entry['validators'] == {'etag': '"v1"'}
+    assert cache.is_fresh(entry)
+
+
+def test_store_failed(cache_dir):
+    cache = ResponseCache(path=cache_dir)
+
+    with pytest.raises(TypeError):
+        cache.store('key', {'id': object()})
+
+    assert os.listdir(cache_dir) == []
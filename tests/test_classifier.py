@@ -0,0 +1,83 @@
+import os
+import shutil
+import tempfile
+
+import pytest
+
+pytest.importorskip('sklearn')
+pytest.importorskip('binaryornot')
+
+from qordoba import classifier
+from qordoba.classifier import Classifier, PREDICT_BATCH_SIZE
+
+
+class FakeModel(object):
+    def __init__(self):
+        self.batches = []
+
+    def predict(self, examples):
+        self.batches.append(len(examples))
+        return ['lang-{}'.format(example) for example in examples]
+
+
+@pytest.fixture
+def model(monkeypatch):
+    model = FakeModel()
+    loads = []
+
+    def load(path):
+        loads.append(path)
+        return model
+
+    monkeypatch.setattr(classifier, 'classifier_model', None)
+    monkeypatch.setattr(classifier.joblib, 'load', load)
+    model.loads = loads
+    return model
+
+
+@pytest.fixture
+def files_dir():
+    path = tempfile.mkdtemp()
+    yield path
+    shutil.rmtree(path)
+
+
+def _write(path, content):
+    with open(path, 'wb') as f:
+        f.write(content)
+    return path
+
+
+def test_predict_many(model, files_dir):
+    paths = [_write(os.path.join(files_dir, '{}.txt'.format(i)), str(i).encode('utf-8'))
+             for i in range(PREDICT_BATCH_SIZE + 2)]
+    binary = _write(os.path.join(files_dir, 'image.png'), b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR' * 10)
+    paths.insert(5, binary)
+
+    predictions = Classifier().predict_many(paths)
+
+    assert predictions[5] is None
+    del predictions[5]
+    assert predictions == ['lang-{}'.format(i) for i in range(PREDICT_BATCH_SIZE + 2)]
+    assert model.batches == [PREDICT_BATCH_SIZE, 2]
+
+
+def test_model_loaded_once(model, files_dir):
+    path = _write(os.path.join(files_dir, 'a.txt'), b'a')
+
+    Classifier().predict_many([path])
+    Classifier().predict(path)
+
+    assert len(model.loads) == 1
+
+
+def test_find_type_without_model(model, files_dir, monkeypatch):
+    model_path = os.path.join(files_dir, 'model.pkl')
+    monkeypatch.setattr(classifier, 'MODEL_PATH', model_path)
+    trained = []
+    monkeypatch.setattr(Classifier, 'train', lambda self: trained.append(True))
+    path = _write(os.path.join(files_dir, 'a.txt'), b'a')
+
+    assert Classifier().find_type(path) == 'lang-a'
+    assert trained == [True]
+    assert not os.path.exists(model_path)
@@ -0,0 +1,38 @@
+import os
+
+import pytest
+
+from qordoba.exclusions import ExclusionMatcher, get_exclusion_matcher
+from qordoba.sources import files_in_project
+
+
+@pytest.mark.parametrize('path,is_dir,expected', [
+    ('node_modules', True, True),
+    ('app/vendor', True, True),
+    ('docs', True, True),
+    ('app/docs', True, False),
+    ('lib/jquery.min.js', False, True),
+    ('README.md', False, True),
+    ('i18n/en/strings.json', False, False),
+    ('i18n', True, False),
+])
+def test_exclusion_matcher(path, is_dir, expected):
+    assert get_exclusion_matcher().is_excluded(path, is_dir=is_dir) is expected
+
+
+def test_exclusion_matcher_invalid_rule():
+    matcher = ExclusionMatcher(['(?<name>x)', '^build/'])
+
+    assert matcher.rules_count == 1
+    assert matcher.exclude_dir('build', 'build')
+    assert not matcher.is_excluded('x')
+
+
+def test_exclusion_matcher_prunes_walk(curdir):
+    root = os.path.join(curdir, 'fixtures', 'push')
+    matcher = ExclusionMatcher(['(^|/)[A-C]/'])
+
+    files = list(files_in_project(root, return_absolute_path=False, exclude_dir=matcher.exclude_dir))
+
+    assert os.path.join('sources', 'D', 'sampleD.json') in files
+    assert os.path.join('sources', 'C', 'sampleC.json') not in files
@@ -1,8 +1,16 @@
+import json
+import os
+import shutil
+import tempfile
+
 import pytest
 
 from copy import deepcopy
+from mock import MagicMock
+from io import BytesIO
 
-from qordoba.project import ResponsePaginatedResult
+from qordoba.project import ResponsePaginatedResult, ProjectAPI, create_session, conditional_stats
+from qordoba.settings import get_http_settings
 from tests.assertions import assert_deep_equal
 
 
@@ -33,3 +41,203 @@ def test_paginated_result(api_pages_response, page_search_response):
 
     records = list(query.filter_by(lambda p: p['url'] == 'test.yml'))
     assert len(records) == 2
+
+
+@pytest.fixture
+def api_config():
+    return {'access_token': 'token', 'project_id': 1, 'organization_id': 2, 'cache': {'enabled': False}}
+
+
+@pytest.fixture
+def cache_dir():
+    path = tempfile.mkdtemp()
+    yield path
+    shutil.rmtree(path)
+
+
+def test_session_reuses_connections(http_server, api_config):
+    http_server.add_route('/api/languages', (200, {}, {'languages': []}))
+    api = ProjectAPI(api_config, session=create_session(get_http_settings(api_config)))
+
+    for _ in range(3):
+        assert api.get_languages() == []
+
+    stats = api.pool_stats()
+    assert stats == {'requests': 3, 'hits': 2, 'misses': 1}
+
+
+def test_session_without_keep_alive(http_server, api_config):
+    api_config['http'] = {'keep_alive': False}
+    http_server.add_route('/api/languages', (200, {}, {'languages': []}))
+    api = ProjectAPI(api_config, session=create_session(get_http_settings(api_config)))
+
+    api.get_languages()
+
+    _, _, headers, _ = http_server.requests[0]
+    assert headers['Connection'] == 'close'
+
+
+def test_append_files(http_server, api_config):
+    http_server.add_route('/api/projects/1/append_files', (200, {}, {'result': 'success'}))
+    api = ProjectAPI(api_config, session=create_session(get_http_settings(api_config)))
+
+    api.append_files([{'upload_id': 'a', 'file_name': 'a.json'},
+                      {'upload_id': 'b', 'file_name': 'b.json', 'version_tag': 'v1'}])
+
+    _, _, _, body = http_server.requests[0]
+    assert json.loads(body.decode('utf-8')) == [{'id': 'a', 'file_name': 'a.json', 'source_columns': []},
+                                                {'id': 'b', 'file_name': 'b.json', 'source_columns': [],
+                                                 'version_tag': 'v1'}]
+
+
+def test_stream_file(http_server, api_config):
+    content = b'x' * 2500
+    http_server.add_route('/archive.zip', (200, {}, content))
+    api = ProjectAPI(api_config, session=create_session(get_http_settings(api_config)))
+    f = BytesIO()
+
+    size = api.stream_file(http_server.url + 'archive.zip', f, chunk_size=1000)
+
+    assert size == len(content)
+    assert f.getvalue() == content
+    _, _, headers, _ = http_server.requests[0]
+    assert 'X-AUTH-TOKEN' not in headers
+
+
+def _paged_records(total):
+    def request(limit=50, offset=0):
+        records = [{'id': i} for i in range(offset, min(offset + limit, total))]
+        return {'pages': records, 'meta': {'paging': {'total_results': total}}}
+
+    return request
+
+
+def test_paginated_result_prefetch():
+    request = MagicMock(side_effect=_paged_records(23))
+    query = ResponsePaginatedResult('pages', request, (), {'limit': 5}, workers=3)
+
+    assert [r['id'] for r in query] == list(range(23))
+    assert request.call_count == 5
+    assert sorted(call[1]['offset'] for call in request.call_args_list) == [0, 5, 10, 15, 20]
+
+    assert [r['id'] for r in query] == list(range(23))
+    assert request.call_count == 5
+
+
+def test_paginated_result_prefetch_partial():
+    request = MagicMock(side_effect=_paged_records(23))
+    query = ResponsePaginatedResult('pages', request, (), {'limit': 5}, workers=3)
+
+    assert [r['id'] for r in query.get(7)] == list(range(7))
+    assert [r['id'] for r in query] == list(range(23))
+
+
+def test_paginated_page_size(http_server, api_config):
+    api_config['http'] = {'page_size': 2, 'pagination_workers': 2}
+    http_server.add_route('/api/projects/1/languages/5/files', lambda handler: (200, {}, {
+        'files': [{'id': 1}, {'id': 2}] if 'offset=0' in handler.path else [{'id': 3}],
+        'meta': {'paging': {'total_results': 3}}
+    }))
+    api = ProjectAPI(api_config, session=create_session(get_http_settings(api_config)))
+
+    assert [page['id'] for page in api.get_pages(5)] == [1, 2, 3]
+    assert sorted(path for _, path, _, _ in http_server.requests) == [
+        '/api/projects/1/languages/5/files?limit=2&offset=0',
+        '/api/projects/1/languages/5/files?limit=2&offset=2',
+    ]
+
+
+def test_cached_metadata(http_server, api_config, cache_dir):
+    api_config['cache'] = {'path': cache_dir, 'ttl': 60}
+    http_server.add_route('/api/languages', (200, {}, {'languages': [{'id': 1}]}))
+    http_server.add_route('/api/projects/1', (200, {}, {'project': {'id': 1}}))
+    session = create_session(get_http_settings(api_config))
+
+    for _ in range(2):
+        api = ProjectAPI(api_config, session=session)
+        assert api.get_languages() == [{'id': 1}]
+        assert api.get_project() == {'id': 1}
+    assert len(http_server.requests) == 2
+
+    api_config['refresh_cache'] = True
+    api = ProjectAPI(api_config, session=session)
+    assert api.get_project() == {'id': 1}
+    assert len(http_server.requests) == 3
+
+    api_config['refresh_cache'] = False
+    api_config['access_token'] = 'other-token'
+    api = ProjectAPI(api_config, session=session)
+    assert api.get_project() == {'id': 1}
+    assert len(http_server.requests) == 4
+
+
+def test_cached_metadata_expired(http_server, api_config, cache_dir):
+    api_config['cache'] = {'path': cache_dir, 'ttl': 0}
+    http_server.add_route('/api/languages', (200, {}, {'languages': []}))
+    api = ProjectAPI(api_config, session=create_session(get_http_settings(api_config)))
+
+    api.get_languages()
+    api.get_languages()
+
+    assert len(http_server.requests) == 2
+
+
+def test_conditional_requests(http_server, api_config, cache_dir):
+    api_config['cache'] = {'path': cache_dir}
+    report = {'languages': [{'id': 190, 'code': 'ru-ru', 'milestones': []}] * 50}
+
+    def progress(handler):
+        if handler.headers.get('If-None-Match') == '"v1"':
+            return 304, {'ETag': '"v1"'}, b''
+        return 200, {'ETag': '"v1"'}, report
+
+    http_server.add_route('/api/projects/1/reports/progress', progress)
+    api = ProjectAPI(api_config, session=create_session(get_http_settings(api_config)))
+    stats = conditional_stats()
+
+    assert api.get_report_progress() == report
+    assert api.get_report_progress() == report
+
+    _, _, first_headers, _ = http_server.requests[0]
+    _, _, second_headers, _ = http_server.requests[1]
+    assert 'If-None-Match' not in first_headers
+    assert second_headers['If-None-Match'] == '"v1"'
+
+    new_stats = conditional_stats()
+    assert new_stats['not_modified'] == stats['not_modified'] + 1
+    assert new_stats['bytes_saved'] - stats['bytes_saved'] == len(json.dumps(report))
+
+
+def test_get_pages_caches_first_page(http_server, api_config, cache_dir):
+    api_config['cache'] = {'path': cache_dir}
+    api_config['http'] = {'page_size': 2, 'pagination_workers': 1}
+    http_server.add_route('/api/projects/1/languages/5/files', lambda handler: (200, {'ETag': '"v1"'}, {
+        'files': [{'id': 1}, {'id': 2}] if 'offset=0' in handler.path else [{'id': 3}],
+        'meta': {'paging': {'total_results': 3}}
+    }))
+    api = ProjectAPI(api_config, session=create_session(get_http_settings(api_config)))
+
+    assert [page['id'] for page in api.get_pages(5)] == [1, 2, 3]
+    assert len(os.listdir(cache_dir)) == 1
+
+
+def test_page_search_not_conditional(http_server, api_config, cache_dir):
+    api_config['cache'] = {'path': cache_dir}
+    api_config['http'] = {'pagination_workers': 1}
+    pages = {'pages': [{'page_id': 1}], 'meta': {'paging': {'total_results': 1}}}
+
+    def search(handler):
+        # preconditions of POST requests fail with 412
+        if handler.headers.get('If-Modified-Since') or handler.headers.get('If-None-Match'):
+            return 412, {}, b''
+        return 200, {'Last-Modified': 'Mon, 01 Jan 2018 00:00:00 GMT', 'ETag': '"v1"'}, pages
+
+    http_server.add_route('/api/projects/1/languages/5/page_settings/search', search)
+    api = ProjectAPI(api_config, session=create_session(get_http_settings(api_config)))
+
+    assert list(api.page_search(5, status=['completed'])) == pages['pages']
+    assert list(api.page_search(5, status=['completed'])) == pages['pages']
+
+    assert len(http_server.requests) == 2
+    assert 'If-Modified-Since' not in http_server.requests[1][2]
+    assert not os.path.exists(cache_dir) or os.listdir(cache_dir) == []
@@ -0,0 +1,112 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from io import BytesIO
+
+aiohttp = pytest.importorskip('aiohttp')
+
+from qordoba.project import QordobaResponseError
+from qordoba.project_async import AsyncProjectAPI
+from qordoba.scheduler import RequestScheduler
+
+
+@pytest.fixture
+def api_config():
+    return {'access_token': 'token', 'project_id': 1, 'organization_id': 2}
+
+
+def run(coro):
+    return asyncio.new_event_loop().run_until_complete(coro)
+
+
+def test_async_page_search(http_server, api_config):
+    api_config['http'] = {'page_size': 2, 'pagination_workers': 3}
+
+    def search(handler):
+        offset = int(handler.path.split('offset=')[1].split('&')[0])
+        records = [{'id': i} for i in range(offset, min(offset + 2, 5))]
+        return 200, {}, {'pages': records, 'meta': {'paging': {'total_results': 5}}}
+
+    http_server.add_route('/api/projects/1/languages/5/page_settings/search', search, method='POST')
+
+    async def main():
+        async with AsyncProjectAPI(api_config) as api:
+            return [page['id'] async for page in api.page_search(5, search_string='a.json')]
+
+    assert run(main()) == [0, 1, 2, 3, 4]
+    assert len(http_server.requests) == 3
+    _, _, headers, body = http_server.requests[0]
+    assert headers['X-AUTH-TOKEN'] == 'token'
+    assert json.loads(body.decode('utf-8')) == {'title': 'a.json'}
+
+
+def test_async_download_file(http_server, api_config):
+    http_server.add_route('/api/projects/1/languages/5/pages/7/segments/milestones/-100/export',
+                          (200, {}, {'token': 't', 'filename': 'a.json'}))
+    http_server.add_route('/api/file/download', (200, {}, b'content'))
+    f = BytesIO()
+
+    async def main():
+        async with AsyncProjectAPI(api_config) as api:
+            content = await api.download_file(7, 5)
+            await api.download_file(7, 5, fileobj=f)
+            return content
+
+    assert run(main()) == b'content'
+    assert f.getvalue() == b'content'
+
+
+def test_async_download_not_retried_mid_body(http_server, api_config):
+    def stalled_body(handler):
+        handler.wfile.write(b'01234')
+        handler.wfile.flush()
+        time.sleep(1)
+
+    http_server.add_route('/api/projects/1/languages/5/pages/7/segments/milestones/-100/export',
+                          (200, {}, {'token': 't', 'filename': 'a.json'}))
+    http_server.add_route('/api/file/download', (200, {'Content-Length': '10'}, stalled_body))
+    f = BytesIO()
+
+    async def main():
+        timeout = aiohttp.ClientTimeout(sock_read=0.2)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            api = AsyncProjectAPI(api_config, session=session, scheduler=RequestScheduler(retries=2, backoff=0))
+            with pytest.raises(asyncio.TimeoutError):
+                await api.download_file(7, 5, fileobj=f)
+
+    run(main())
+    assert f.getvalue() == b'01234'
+    assert len([path for _, path, _, _ in http_server.requests if path.startswith('/api/file/download')]) == 1
+
+
+def test_async_retry_and_error(http_server, api_config):
+    responses = iter([(503, {'Retry-After': '0'}, b''), (200, {}, {'languages': [{'id': 1}]})])
+    http_server.add_route('/api/languages', lambda handler: next(responses))
+    http_server.add_route('/api/projects/1', (500, {}, {'errMessage': 'error'}))
+
+    async def main():
+        async with AsyncProjectAPI(api_config, scheduler=RequestScheduler(retries=2)) as api:
+            languages = await api.get_languages()
+            with pytest.raises(QordobaResponseError) as exc:
+                await api.get_project()
+            return languages, str(exc.value)
+
+    assert run(main()) == ([{'id': 1}], 'error')
+    assert len(http_server.requests) == 3
+
+
+def test_async_upload_retried_on_429(http_server, api_config):
+    responses = iter([(429, {'Retry-After': '0'}, b''), (200, {}, {'upload_id': 'u1'})])
+    http_server.add_route('/api/organizations/2/upload/uploadFile_anyType', lambda handler: next(responses))
+
+    async def main():
+        async with AsyncProjectAPI(api_config) as api:
+            return await api.upload_anytype_file(BytesIO(b'{"key": "value"}'), 'a.json', 'JSON')
+
+    assert run(main()) == {'upload_id': 'u1'}
+    assert len(http_server.requests) == 2
+    for _, _, _, body in http_server.requests:
+        assert b'{"key": "value"}' in body
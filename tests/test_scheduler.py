@@ -0,0 +1,103 @@
+import pytest
+import requests
+
+from mock import MagicMock
+
+from qordoba.project import ProjectAPI, create_session, QordobaResponseError
+from qordoba.scheduler import RequestScheduler, TokenBucket, parse_retry_after
+from qordoba.settings import get_http_settings
+
+
+def _response(status_code, headers=None):
+    return MagicMock(status_code=status_code, headers=headers or {}, reason='reason')
+
+
+@pytest.fixture
+def sleep():
+    return MagicMock()
+
+
+def test_parse_retry_after():
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('3') == 3
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:10 GMT', now=1445412480) == 10
+    assert parse_retry_after('soon') is None
+
+
+def test_retry_idempotent_request(sleep):
+    session = MagicMock()
+    session.request.side_effect = [_response(503), requests.ConnectionError(), _response(200)]
+    scheduler = RequestScheduler(retries=3, backoff=1, sleep=sleep)
+
+    resp = scheduler.send(session, 'GET', 'url')
+
+    assert resp.status_code == 200
+    assert session.request.call_count == 3
+    assert sleep.call_count == 2
+    assert 0 <= sleep.call_args_list[1][0][0] <= 2
+
+
+def test_retry_gives_up(sleep):
+    session = MagicMock()
+    session.request.return_value = _response(502)
+    scheduler = RequestScheduler(retries=2, sleep=sleep)
+
+    assert scheduler.send(session, 'GET', 'url').status_code == 502
+    assert session.request.call_count == 3
+
+
+def test_post_retried_on_429_only(sleep):
+    session = MagicMock()
+    session.request.side_effect = [_response(429, {'Retry-After': '7'}), _response(503)]
+    scheduler = RequestScheduler(retries=3, sleep=sleep)
+
+    assert scheduler.send(session, 'POST', 'url').status_code == 503
+    assert session.request.call_count == 2
+    sleep.assert_called_once_with(7)
+
+    session.request.side_effect = requests.ConnectionError()
+    with pytest.raises(requests.ConnectionError):
+        scheduler.send(session, 'POST', 'url')
+
+
+def test_retry_rewinds_files(sleep):
+    stream = MagicMock()
+    session = MagicMock()
+    session.request.side_effect = [_response(429), _response(200)]
+    scheduler = RequestScheduler(sleep=sleep)
+
+    scheduler.send(session, 'POST', 'url', files={'file': ('a.json', stream, 'application/json')})
+
+    stream.seek.assert_called_once_with(0)
+
+
+def test_token_bucket():
+    now = [0.0]
+
+    def sleep(seconds):
+        now[0] += seconds
+
+    bucket = TokenBucket(2, burst=2, clock=lambda: now[0], sleep=sleep)
+    for _ in range(6):
+        bucket.acquire()
+    assert now[0] == pytest.approx(2)
+
+    bucket.pause(10)
+    bucket.acquire()
+    assert now[0] == pytest.approx(12.5)
+
+
+def test_api_retries_server_error(http_server):
+    config = {'access_token': 'token', 'project_id': 1, 'organization_id': 2, 'cache': {'enabled': False}}
+    responses = iter([(503, {'Retry-After': '0'}, b''), (200, {}, {'languages': [{'id': 1}]})])
+    http_server.add_route('/api/languages', lambda handler: next(responses))
+    http_server.add_route('/api/projects/1', (500, {}, {'errMessage': 'error'}))
+    api = ProjectAPI(config, session=create_session(get_http_settings(config)),
+                     scheduler=RequestScheduler(retries=2))
+
+    assert api.get_languages() == [{'id': 1}]
+    assert len(http_server.requests) == 2
+
+    with pytest.raises(QordobaResponseError):
+        api.get_project()
+    assert len(http_server.requests) == 3
@@ -1,10 +1,14 @@
 import os
+import shutil
+import tempfile
 
 import pytest
 from collections import OrderedDict
 from qordoba.languages import Language
 from qordoba.sources import validate_push_pattern, PatternNotValid, create_target_path_by_pattern, to_native, \
-    find_files_by_pattern, TranslationFile, add_project_file_formats
+    find_files_by_pattern, TranslationFile, add_project_file_formats, ContentTypeResolver, get_content_type_code, \
+    FileExtensionNotAllowed, PullPatternTemplate, get_pull_template, files_in_project, translation_files_in_project, \
+    PushPatternMatcher, find_files_by_patterns, to_posix
 
 PATTERN1 = 'i18n/<language_code>/translations.json'
 PATTERN2 = 'folder1/values-<language_lang_code>/strings.xml'
@@ -136,3 +140,115 @@ def test_add_project_file_formats():
     assert result['resx'] == 'resx'
     assert result['txt'] == 'plaintext'
 
+
+
+def test_content_type_resolver():
+    resolver = ContentTypeResolver([{'content_type_code': 'YAML'}, {'content_type_code': 'JSON'}],
+                                   file_formats={'plaintext': ('txt', ), 'JSON': ('jsn', )}, allowed_extensions={})
+
+    assert resolver.get('yml') == 'YAML'
+    assert resolver.get('xliff') == 'xliff'
+    assert resolver.get('txt') == 'plaintext'
+    assert resolver.get('jsn') == 'JSON'
+    assert resolver.get('exe') is None
+
+    # overrides of built in extensions
+    resolver = ContentTypeResolver([], file_formats={'YAML': ['yml'], 'XLIFF1.2': ['xlf']})
+    assert resolver.get('yml') == 'YAML'
+    assert resolver.get('xlf') == 'XLIFF1.2'
+
+
+def test_get_content_type_code():
+    assert get_content_type_code(TranslationFile('config/en.yml', 'en-us', './'), []) == 'YAMLi18n'
+    assert get_content_type_code(TranslationFile('strings.xlf', 'en-us', './'),
+                                 [{'content_type_code': 'XLIFF1.2'}]) == 'XLIFF1.2'
+
+    with pytest.raises(FileExtensionNotAllowed):
+        get_content_type_code(TranslationFile('app.exe', 'en-us', './'), [])
+
+
+def test_pull_pattern_template():
+    template = PullPatternTemplate('i18n/<language_code>/<unknown>/<filename>.<extension>')
+
+    assert template.segments == [(False, 'i18n/'), (True, 'language_code'), (False, '/<unknown>/'),
+                                 (True, 'filename'), (False, '.'), (True, 'extension')]
+    assert template.render(LANGUAGE_FR, source_name='strings.json', version_tag='v1') == \
+        'i18n/fr-fr/<unknown>/v1_strings.json'
+    assert get_pull_template(PATTERN1) is get_pull_template(PATTERN1)
+
+
+def test_pull_pattern_template_lproj():
+    template = PullPatternTemplate('<language_code>.lproj/<local_capitalized>.strings')
+
+    assert template.render(LANGUAGE_CN) == 'zh-CN.lproj/CN.strings'
+    assert template.render(LANGUAGE_FR) == 'fr-fr.lproj/FR.strings'
+
+
+@pytest.fixture
+def project_tree():
+    root = tempfile.mkdtemp()
+    for path in ('a.json', 'sub/b.json', 'sub/deep/c.json', '.git/config', 'sub/.hidden.json',
+                 'node_modules/lib/d.json'):
+        path = os.path.join(root, *path.split('/'))
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        open(path, 'w').close()
+
+    if hasattr(os, 'symlink'):
+        # cycle and second link to the same folder
+        os.symlink(root, os.path.join(root, 'sub', 'loop'))
+        os.symlink(os.path.join(root, 'sub', 'deep'), os.path.join(root, 'deep-link'))
+
+    yield root
+    shutil.rmtree(root)
+
+
+def test_files_in_project(project_tree):
+    files = list(files_in_project(project_tree, return_absolute_path=False))
+
+    # `deep-link` comes first, so `sub/deep` is not visited again
+    assert files == [os.path.join(*p) for p in (('a.json', ), ('deep-link', 'c.json'), ('sub', 'b.json'))]
+
+
+def test_translation_files_in_project(project_tree, mock_lang_storage):
+    files = list(translation_files_in_project(project_tree, 'en-us', exclude_dir=lambda relpath, name: False))
+
+    assert all(isinstance(f, TranslationFile) for f in files)
+    assert os.path.join('node_modules', 'lib', 'd.json') in [f.relpath for f in files]
+    assert files[0].fullpath == os.path.join(project_tree, 'a.json')
+
+
+@pytest.mark.parametrize('patterns,expected', [
+    (['./sources/*'], ['sources/C/sampleC.json', 'sources/D/sampleD.json',
+                       'sources/sampleA.json', 'sources/sampleB.json']),
+    (['./sources/*/*.json'], ['sources/C/sampleC.json', 'sources/D/sampleD.json']),
+    (['sources/*/sample[A,C].json', 'sources/C/*', '*.json'], ['sources/C/sampleC.json', 'test.json']),
+    (['sources/[AB]/*.json'], []),
+    (['./*'], ['sources/C/sampleC.json', 'sources/D/sampleD.json',
+               'sources/sampleA.json', 'sources/sampleB.json', 'test.json']),
+])
+def test_push_pattern_matcher(mock_change_dir, patterns, expected):
+    found = PushPatternMatcher(patterns, mock_change_dir).find()
+
+    assert sorted(to_native(path) for path in found) == sorted(to_native(path) for path in expected)
+
+
+def test_push_pattern_matcher_hidden(project_tree):
+    def find(*patterns):
+        return sorted(to_posix(path) for path in PushPatternMatcher(patterns, project_tree).find())
+
+    assert find('sub/.hidden.json') == ['sub/.hidden.json']
+    assert find(os.path.join(project_tree, 'sub', '.hidden.json')) == ['sub/.hidden.json']
+    assert find('sub/.*.json') == ['sub/.hidden.json']
+    assert find('sub/*.json') == ['sub/b.json']
+    assert '.git/config' not in find('./*')
+    assert 'sub/.hidden.json' not in find('./*')
+
+
+def test_find_files_by_patterns(mock_change_dir, mock_lang_storage):
+    patterns = [os.path.join(mock_change_dir, 'test.json'), 'test.json', 'sources/*']
+
+    paths = list(find_files_by_patterns(mock_change_dir, patterns, LANGUAGE_EN, []))
+
+    assert len(paths) == 5
+    assert paths[0].posix_path == 'test.json'
@@ -0,0 +1,100 @@
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from qordoba.languages import Language
+from qordoba.sources import validate_path
+from qordoba.state import FindNewState, PushState, STATE_DIR
+
+LANGUAGE_EN = Language({
+    "id": 94,
+    "name": "English - United States",
+    "code": "en-us",
+    "direction": "ltr",
+    "override_order": "aaa - aaa - English - United States"
+})
+
+
+@pytest.fixture
+def project_dir():
+    path = tempfile.mkdtemp()
+    yield path
+    shutil.rmtree(path)
+
+
+@pytest.fixture
+def source_file(project_dir, mock_lang_storage):
+    with open(os.path.join(project_dir, 'strings.json'), 'w') as f:
+        f.write('{"key": "value"}')
+    return validate_path(project_dir, './strings.json', LANGUAGE_EN)
+
+
+def test_push_state_new_file(project_dir, source_file):
+    state = PushState(project_dir, 1)
+    assert state.is_changed(source_file)
+    assert state.get_page_id(source_file) is None
+
+
+def test_push_state_unchanged(project_dir, source_file):
+    state = PushState(project_dir, 1)
+    state.record(source_file, page_id=10)
+    state.save()
+
+    assert os.path.exists(os.path.join(project_dir, STATE_DIR, PushState.name))
+
+    state = PushState(project_dir, 1)
+    assert not state.is_changed(source_file)
+    assert state.get_page_id(source_file) == 10
+    assert state.is_changed(source_file, version='v2')
+    assert state.get_page_id(source_file, version='v2') is None
+
+
+def test_push_state_touched(project_dir, source_file):
+    state = PushState(project_dir, 1)
+    state.record(source_file)
+
+    stat = os.stat(source_file.fullpath)
+    os.utime(source_file.fullpath, (stat.st_atime, stat.st_mtime + 10))
+    assert not state.is_changed(source_file)
+
+    with open(source_file.fullpath, 'w') as f:
+        f.write('{"key": "VALUE"}')
+    os.utime(source_file.fullpath, (stat.st_atime, stat.st_mtime + 20))
+    assert state.is_changed(source_file)
+
+
+def test_push_state_projects(project_dir, source_file):
+    state = PushState(project_dir, 1)
+    state.record(source_file, page_id=10)
+    state.save()
+
+    state = PushState(project_dir, 2)
+    assert state.is_changed(source_file)
+    assert state.get_page_id(source_file) is None
+    state.record(source_file, page_id=20)
+    state.save()
+
+    state = PushState(project_dir, 1)
+    assert not state.is_changed(source_file)
+    assert state.get_page_id(source_file) == 10
+
+
+def test_find_new_state(project_dir, source_file):
+    state = FindNewState(project_dir)
+    stat = os.stat(source_file.fullpath)
+    assert state.is_changed('strings.json', stat)
+
+    state.record('./strings.json', stat, {'path': 'strings.json'})
+    state.save()
+
+    state = FindNewState(project_dir)
+    assert not state.is_changed('strings.json', stat)
+    assert state.get_result('strings.json') == {'path': 'strings.json'}
+
+    os.utime(source_file.fullpath, (stat.st_atime, stat.st_mtime + 10))
+    assert state.is_changed('strings.json', os.stat(source_file.fullpath))
+
+    state.retain([])
+    assert state.data == {}
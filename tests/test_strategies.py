@@ -1,9 +1,61 @@
 import os
 
 import pytest
-from qordoba.strategies import Extension
+from qordoba.strategies import Extension, Filename, LanguageIndex, get_language_index, init_language_index
+
+LANGUAGES = {
+    'JSON': {'extensions': ['.json', '.JSONLD'], 'filenames': ['.jshintrc']},
+    'TypeScript': {'extensions': ['.ts']},
+    'TypeScript Definitions': {'extensions': ['.d.ts']},
+    'XML': {'extensions': ['.xml', '.ts']},
+    'Text': {'type': 'prose'},
+}
+
 
 @pytest.fixture
-def valid_extension():
-    filename = 'this.is.a.json'
-    assert Extension.find(filename) == "JSON"
+def index():
+    return LanguageIndex.from_languages(LANGUAGES)
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(language_cache_dir):
+    return language_cache_dir
+
+
+def test_extension(index):
+    extension = Extension(index)
+    assert extension.find('this.is.a.json') == ['JSON']
+    assert extension.find('data/context.jsonld') == ['JSON']
+    assert extension.find('strings.ts') == ['TypeScript', 'XML']
+    assert extension.find('lib.d.ts') == ['TypeScript Definitions']
+    assert extension.find('README') == []
+    assert extension.find('.json') == []
+
+
+def test_filename(index):
+    filename = Filename(index)
+    assert filename.find('project/.jshintrc') == ['JSON']
+    assert filename.find('project/jshintrc') == []
+
+
+def test_language_index_cache(cache_dir):
+    index = LanguageIndex.load(cache_dir=cache_dir)
+    assert index.by_extension('this.is.a.json')[0] == 'JSON'
+    assert len(os.listdir(cache_dir)) == 1
+
+    cached = LanguageIndex.load(cache_dir=cache_dir)
+    assert cached.extensions == index.extensions
+    assert cached.filenames == index.filenames
+
+
+def test_init_language_index(cache_dir):
+    config_cache_dir = os.path.join(cache_dir, 'config')
+
+    index = init_language_index({'cache': {'path': config_cache_dir}})
+
+    assert get_language_index() is index
+    assert len(os.listdir(config_cache_dir)) == 1
+
+    init_language_index({'cache': {'path': config_cache_dir, 'enabled': False}})
+    assert Extension().find('strings.json')[0] == 'JSON'
+    assert len(os.listdir(config_cache_dir)) == 1